@@ -1,5 +1,15 @@
 import os
 import atexit
+
+# gevent ワーカーで起動された場合は psycopg2 も協調的 I/O にする（DB接続の作成前に適用が必要）
+try:
+    from gevent import monkey
+    if monkey.is_module_patched('socket'):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+except ImportError:
+    pass
+
 from flask import Flask
 from config import get_config
 from models import db_manager
@@ -35,6 +45,48 @@ def create_app(config=None):
     logger.info(f"📊 Database URL: {config.DATABASE_URL[:30]}..." if config.DATABASE_URL else "📊 Database URL: None")
     logger.info("=" * 70)
     
+    # レスポンス圧縮（HTML/JSON を br/gzip で返す）
+    try:
+        from flask_compress import Compress
+        Compress(app)
+        logger.info("✅ Response compression enabled")
+    except ImportError:
+        logger.warning("⚠️ flask-compress not installed, responses are sent uncompressed")
+    
+    # コンパイル済みテンプレートをバイトコードキャッシュに保存（再起動・他ワーカーでも再コンパイル不要）
+    try:
+        from jinja2 import FileSystemBytecodeCache
+        os.makedirs(config.JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(config.JINJA_BYTECODE_CACHE_DIR)
+    except OSError as e:
+        logger.warning(f"⚠️ Jinja bytecode cache disabled: {e}")
+    
+    # JSON 応答は orjson でシリアライズ（未インストールなら Flask 標準の json）
+    try:
+        import orjson
+        from flask.json.provider import DefaultJSONProvider
+        
+        class OrjsonProvider(DefaultJSONProvider):
+            """出力は Flask 標準と同じにそろえる（日時は HTTP-date、キーはソート）"""
+            
+            def dumps(self, obj, **kwargs):
+                # datetime/date は orjson の ISO-8601 ではなく self.default（http_date）に渡す
+                option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                if self.sort_keys:
+                    option |= orjson.OPT_SORT_KEYS
+                return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+            
+            def loads(self, s, **kwargs):
+                # object_hook などの指定（セッションのタグ付き JSON の復元など）は標準の json に任せる
+                if kwargs:
+                    return super().loads(s, **kwargs)
+                return orjson.loads(s)
+        
+        app.json = OrjsonProvider(app)
+        logger.info("✅ orjson JSON provider enabled")
+    except ImportError:
+        logger.warning("⚠️ orjson not installed, using the standard json module")
+    
     # データベース初期化
     try:
         db_manager.init_database()
@@ -74,6 +126,7 @@ def create_app(config=None):
             scheduler_manager.shutdown()
         except Exception as e:
             logger.error(f"❌ Scheduler shutdown error: {e}")
+        db_manager.close_pool()
     
     atexit.register(shutdown)
     
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 
 # ================================================================================
@@ -20,6 +21,18 @@ class Config:
     # キャッシュ設定
     CACHE_DURATION = 300  # 5分
     
+    # レスポンス圧縮（flask-compress）
+    COMPRESS_MIMETYPES = ['text/html', 'application/json', 'text/css', 'application/javascript']
+    COMPRESS_ALGORITHM = ['br', 'gzip']
+    COMPRESS_LEVEL = 6
+    COMPRESS_BR_LEVEL = 4
+    COMPRESS_MIN_SIZE = 500
+    
+    # テンプレート（本番では更新確認の stat をせず、コンパイル結果はファイルに保存してワーカー間で共有）
+    TEMPLATES_AUTO_RELOAD = False
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR',
+                                              os.path.join(tempfile.gettempdir(), 'portfolio_jinja_bc'))
+    
     # API タイムアウト
     API_TIMEOUT = 5
     
@@ -32,11 +45,28 @@ class Config:
         DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
     
     USE_POSTGRES = DATABASE_URL is not None
+    
+    # コネクションプール設定
+    # 常時確保しておく接続数（同時リクエストでもハンドシェイクなしで使える分を温めておく）
+    # psycopg2 のプールは返却時にアイドル接続が DB_POOL_MIN を超える分を閉じるため、想定する定常の同時実行数に合わせる
+    DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 10))
+    DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 20))
+    # プールの全接続が使用中のとき、空きを待つ最大秒数（gevent ワーカーでは同時リクエスト数が接続数を上回るため）
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    # プール上限はサーバーの max_connections のこの割合まで
+    DB_POOL_MAX_FRACTION = float(os.environ.get('DB_POOL_MAX_FRACTION', 0.25))
+    # この秒数を超えて使われた接続は作り直す（サーバー/LB側のアイドル切断対策）
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    # この秒数以上アイドルだった接続のみ取得時に SELECT 1 で生存確認する
+    DB_POOL_PRE_PING_IDLE = float(os.environ.get('DB_POOL_PRE_PING_IDLE', 30))
+    # SQLite で再利用する接続数
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 5))
 
 class DevelopmentConfig(Config):
     """開発環境設定"""
     DEBUG = True
     TESTING = False
+    TEMPLATES_AUTO_RELOAD = True
 
 class ProductionConfig(Config):
     """本番環境設定"""
@@ -1,120 +1,459 @@
 import sqlite3
 from contextlib import contextmanager
+from werkzeug.security import generate_password_hash
 from config import get_config
 from utils import logger
 import time
+import random
+import threading
+import queue
 
 try:
     import psycopg2
     from psycopg2.extras import RealDictCursor
     from psycopg2 import pool as pg_pool
     from psycopg2 import extensions
+    # NUMERIC も float で受け取る（呼び出し側での Decimal→float 変換を不要にする）
+    extensions.register_type(extensions.new_type(
+        extensions.DECIMAL.values, 'DEC2FLOAT',
+        lambda value, cursor: float(value) if value is not None else None
+    ))
+    
+    class _PooledConnection(extensions.connection):
+        """作成時刻・最終返却時刻を自身に持つ接続（プールが閉じた接続の記録は接続と一緒に消える）"""
+        
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.born_at = time.monotonic()
+            self.last_used_at = None
+    
     POSTGRES_AVAILABLE = True
 except ImportError:
     POSTGRES_AVAILABLE = False
     logger.warning("⚠️ psycopg2 not available, using SQLite")
 
+# 接続リトライのバックオフ設定（秒）
+_BASE_DELAY = 0.5
+_MAX_DELAY = 10.0
+
+# 連続失敗がこの回数・時間窓を超えた場合のみプール全体を再構築
+_POOL_RESET_THRESHOLD = 5
+_POOL_RESET_WINDOW = 60.0
+
+# SQLite 接続ごとに適用する PRAGMA（WAL で読み書きの相互ブロックを解消）
+_SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+)
+
+# 公開デモアカウント用のパスワードハッシュ（ログインのたびに検証されるため低コストの scrypt で事前計算）
+# ※一般ユーザーは generate_password_hash の既定パラメータのまま
+_DEMO_PASSWORD_HASH = generate_password_hash('demo123', method='scrypt:8192:8:1')
+
+def _dict_row_factory(cursor, row):
+    """SQLite の行を dict で返す（PostgreSQL の RealDictCursor と同じ形にそろえる）"""
+    return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+
+# スキーマバージョン（DDL を変更したら上げる）
+SCHEMA_VERSION = 9
+# スキーマ初期化の排他用アドバイザリーロックID
+_SCHEMA_LOCK_ID = 7281001
+
+def _backoff_delay(attempt):
+    """上限付きフルジッター指数バックオフの待機時間を計算"""
+    return random.uniform(0, min(_MAX_DELAY, _BASE_DELAY * (2 ** attempt)))
+
+# スキーマ定義（起動のたびに組み立てず、1つの文字列として1回で送信）
+SCHEMA_DDL_PG = ';\n'.join([
+    # usersテーブル
+    '''CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(255) UNIQUE NOT NULL,
+        password_hash VARCHAR(255) NOT NULL,
+        data_version INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''',
+    # assetsテーブル（display_order追加）
+    '''CREATE TABLE IF NOT EXISTS assets (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        asset_type VARCHAR(50) NOT NULL,
+        symbol VARCHAR(50) NOT NULL,
+        name VARCHAR(255),
+        quantity DOUBLE PRECISION NOT NULL,
+        price DOUBLE PRECISION DEFAULT 0,
+        avg_cost DOUBLE PRECISION DEFAULT 0,
+        display_order INTEGER DEFAULT 0,
+        last_price_update TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+    )''',
+    # asset_historyテーブル
+    '''CREATE TABLE IF NOT EXISTS asset_history (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        record_date DATE NOT NULL,
+        jp_stock_value DOUBLE PRECISION DEFAULT 0,
+        us_stock_value DOUBLE PRECISION DEFAULT 0,
+        cash_value DOUBLE PRECISION DEFAULT 0,
+        gold_value DOUBLE PRECISION DEFAULT 0,
+        crypto_value DOUBLE PRECISION DEFAULT 0,
+        investment_trust_value DOUBLE PRECISION DEFAULT 0,
+        insurance_value DOUBLE PRECISION DEFAULT 0,
+        total_value DOUBLE PRECISION DEFAULT 0,
+        prev_jp_stock_value DOUBLE PRECISION DEFAULT 0,
+        prev_us_stock_value DOUBLE PRECISION DEFAULT 0,
+        prev_cash_value DOUBLE PRECISION DEFAULT 0,
+        prev_gold_value DOUBLE PRECISION DEFAULT 0,
+        prev_crypto_value DOUBLE PRECISION DEFAULT 0,
+        prev_investment_trust_value DOUBLE PRECISION DEFAULT 0,
+        prev_insurance_value DOUBLE PRECISION DEFAULT 0,
+        prev_total_value DOUBLE PRECISION DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+        UNIQUE(user_id, record_date)
+    )''',
+    # 画面から依頼されたバックグラウンドジョブの状態（ワーカー間で共有）
+    '''CREATE TABLE IF NOT EXISTS user_jobs (
+        job_id VARCHAR(255) PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        result INTEGER,
+        error TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''',
+    # schema_versionテーブル
+    '''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''',
+    # インデックス
+    'CREATE INDEX IF NOT EXISTS idx_assets_user_symbol ON assets(user_id, symbol)',
+    # user_id 単独のインデックスは複合インデックス・UNIQUE(user_id, record_date) の先頭列で代替できるため削除
+    'DROP INDEX IF EXISTS idx_assets_user_id',
+    'DROP INDEX IF EXISTS idx_asset_history_user_id',
+    # 履歴取得用のカバリングインデックス（index-only scan で値カラムまで取得）
+    '''CREATE INDEX IF NOT EXISTS idx_asset_history_user_date_cov
+        ON asset_history(user_id, record_date DESC)
+        INCLUDE (total_value, jp_stock_value, us_stock_value, cash_value, gold_value,
+                 crypto_value, investment_trust_value, insurance_value)''',
+    'DROP INDEX IF EXISTS idx_asset_history_user_date',
+    # 既存DB向けのカラム追加（下のインデックスが参照するため DDL 内で先に行う）
+    'ALTER TABLE assets ADD COLUMN IF NOT EXISTS display_order INTEGER DEFAULT 0',
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version INTEGER NOT NULL DEFAULT 0',
+    'ALTER TABLE assets ADD COLUMN IF NOT EXISTS last_price_update TIMESTAMP',
+    # 資産一覧・価格更新対象の抽出用カバリングインデックス（絞り込み・並び順・表示カラムを1本で賄う）
+    # last_price_update は価格更新のたびに書き換わるため含めない（HOT 更新を妨げない。鮮度判定はユーザーの数行をヒープで見るだけ）
+    '''CREATE INDEX IF NOT EXISTS idx_assets_user_type_order_cov3
+        ON assets(user_id, asset_type, display_order, symbol)
+        INCLUDE (id, name, quantity, price, avg_cost)''',
+    'DROP INDEX IF EXISTS idx_assets_user_type_order_cov2',
+    'DROP INDEX IF EXISTS idx_assets_user_type_order_cov',
+    # (user_id, asset_type) は上記の先頭列で代替できるため削除
+    'DROP INDEX IF EXISTS idx_assets_user_type',
+])
+
+SCHEMA_DDL_SQLITE = ';\n'.join([
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        data_version INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS assets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        asset_type TEXT NOT NULL,
+        symbol TEXT NOT NULL,
+        name TEXT,
+        quantity REAL NOT NULL,
+        price REAL DEFAULT 0,
+        avg_cost REAL DEFAULT 0,
+        display_order INTEGER DEFAULT 0,
+        last_price_update TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+    )''',
+    '''CREATE TABLE IF NOT EXISTS asset_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        record_date DATE NOT NULL,
+        jp_stock_value REAL DEFAULT 0,
+        us_stock_value REAL DEFAULT 0,
+        cash_value REAL DEFAULT 0,
+        gold_value REAL DEFAULT 0,
+        crypto_value REAL DEFAULT 0,
+        investment_trust_value REAL DEFAULT 0,
+        insurance_value REAL DEFAULT 0,
+        total_value REAL DEFAULT 0,
+        prev_jp_stock_value REAL DEFAULT 0,
+        prev_us_stock_value REAL DEFAULT 0,
+        prev_cash_value REAL DEFAULT 0,
+        prev_gold_value REAL DEFAULT 0,
+        prev_crypto_value REAL DEFAULT 0,
+        prev_investment_trust_value REAL DEFAULT 0,
+        prev_insurance_value REAL DEFAULT 0,
+        prev_total_value REAL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+        UNIQUE(user_id, record_date)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS user_jobs (
+        job_id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        result INTEGER,
+        error TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''',
+])
+
+# SQLite のインデックス（display_order を参照するため、カラムのマイグレーション後に作成）
+SCHEMA_INDEXES_SQLITE = ';\n'.join([
+    'CREATE INDEX IF NOT EXISTS idx_assets_user_symbol ON assets(user_id, symbol)',
+    'CREATE INDEX IF NOT EXISTS idx_assets_user_type_order ON assets(user_id, asset_type, display_order, symbol)',
+    'DROP INDEX IF EXISTS idx_assets_user_type',
+    # 履歴の (user_id, record_date) は UNIQUE 制約の自動インデックスで、user_id 単独は複合インデックスの先頭列で代替できる
+    'DROP INDEX IF EXISTS idx_assets_user_id',
+    'DROP INDEX IF EXISTS idx_asset_history_user_id',
+    'DROP INDEX IF EXISTS idx_asset_history_user_date',
+])
+
 class DatabaseManager:
     """データベース接続を管理"""
     
     def __init__(self, config=None):
         self.config = config or get_config()
         self.pool = None
+        # プール接続の空き枠（getconn は満杯だと待たずに PoolError になるため、取得前にここで待つ）
+        self._pool_slots = None
+        self._consecutive_failures = 0
+        self._first_failure_at = 0.0
+        self._failure_lock = threading.Lock()
+        # シャットダウン時にリトライ待機を即座に中断するためのイベント
+        self._shutdown_event = threading.Event()
+        # SQLite の再利用接続（PRAGMA 適用済み）
+        self._sqlite_pool = queue.Queue(maxsize=self.config.SQLITE_POOL_SIZE)
         self.use_postgres = self.config.USE_POSTGRES and POSTGRES_AVAILABLE
         
-        logger.info(f"🔧 DatabaseManager initializing...")
-        logger.info(f"📊 USE_POSTGRES: {self.use_postgres}")
-        logger.info(f"📊 DATABASE_URL: {self.config.DATABASE_URL[:50] if self.config.DATABASE_URL else 'None'}...")
+        logger.info("🔧 DatabaseManager initializing...")
+        logger.info("📊 USE_POSTGRES: %s", self.use_postgres)
+        logger.info("📊 DATABASE_URL: %s...", self.config.DATABASE_URL[:50] if self.config.DATABASE_URL else 'None')
         
         if self.use_postgres:
             self._init_pool()
     
-    def _init_pool(self):
-        """コネクションプール初期化"""
+    def _init_pool(self, allow_fallback=True):
+        """コネクションプール初期化
+        
+        SQLite へのフォールバックは起動時のみ（方言は各モジュールの読み込み時に SQL へ焼き込むため、実行中は切り替えない）
+        """
         if self.use_postgres and self.config.DATABASE_URL:
             try:
                 logger.info("🔌 Creating PostgreSQL connection pool...")
-                self.pool = pg_pool.SimpleConnectionPool(
-                    1,  # minconn
-                    20, # maxconn
+                minconn = self.config.DB_POOL_MIN
+                maxconn = max(minconn, self.config.DB_POOL_MAX)
+                # ✅ gunicornのスレッドワーカーから並行アクセスされるためスレッドセーフなプールを使用
+                self.pool = pg_pool.ThreadedConnectionPool(
+                    minconn,
+                    maxconn,
                     self.config.DATABASE_URL,
-                    connect_timeout=10
+                    connect_timeout=10,
+                    connection_factory=_PooledConnection
                 )
-                logger.info("✅ PostgreSQL connection pool initialized")
+                self._cap_pool_size()
+                self._pool_slots = threading.BoundedSemaphore(self.pool.maxconn)
+                logger.info("✅ PostgreSQL connection pool initialized (min=%s, max=%s)", minconn, self.pool.maxconn)
             except Exception as e:
-                logger.error(f"❌ Failed to create connection pool: {e}", exc_info=True)
+                logger.error("❌ Failed to create connection pool: %s", e, exc_info=True)
+                if not allow_fallback:
+                    raise
                 self.use_postgres = False
                 logger.info("⚠️ Falling back to SQLite")
     
-    def _test_connection(self, conn):
-        """接続が有効かテスト"""
+    @contextmanager
+    def _pool_slot(self, timeout=None):
+        """プール接続の空き枠を1つ確保する（空くまで待ち、timeout 秒を超えたら RuntimeError）"""
+        slots = self._pool_slots
+        if slots is None:
+            raise RuntimeError("Database pool not initialized")
+        if timeout is None:
+            timeout = self.config.DB_POOL_TIMEOUT
+        if not slots.acquire(timeout=timeout):
+            raise RuntimeError(f"Timed out after {timeout}s waiting for a database connection")
+        try:
+            yield
+        finally:
+            # プール再構築後も、確保したときのセマフォに返す
+            slots.release()
+    
+    def sql(self, query):
+        """'?' プレースホルダで書いた SQL を接続先の方言に変換（モジュール読み込み時に一度だけ呼ぶ）"""
+        return query.replace('?', '%s') if self.use_postgres else query
+    
+    def _cap_pool_size(self):
+        """サーバーの max_connections に応じてプール上限を調整（起動時に一度だけ）"""
+        conn = self.pool.getconn()
         try:
-            cursor = conn.cursor()
-            cursor.execute('SELECT 1')
+            cursor = conn.cursor(cursor_factory=extensions.cursor)
+            cursor.execute('SHOW max_connections')
+            server_max = int(cursor.fetchone()[0])
             cursor.close()
-            return True
-        except Exception:
-            return False
+            conn.rollback()
+            
+            cap = max(self.pool.minconn, int(server_max * self.config.DB_POOL_MAX_FRACTION))
+            if self.pool.maxconn > cap:
+                logger.info("📉 Capping pool size to %s (server max_connections=%s)", cap, server_max)
+                self.pool.maxconn = cap
+        except Exception as e:
+            logger.warning("⚠️ Could not read max_connections, keeping configured pool size: %s", e)
+        finally:
+            self.pool.putconn(conn)
+    
+    def _connect_sqlite(self):
+        """SQLite 接続を作成（PRAGMA は接続作成時に一度だけ適用）"""
+        # タイムアウトを30秒に延長（ロック対策）
+        # 接続は再利用されるので、文の準備結果も多めに保持して再パースを避ける
+        conn = sqlite3.connect('portfolio.db', timeout=30.0, check_same_thread=False, cached_statements=512)
+        conn.row_factory = _dict_row_factory
+        for pragma in _SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def _acquire_sqlite(self):
+        """再利用可能な SQLite 接続を取得（なければ新規作成）"""
+        try:
+            return self._sqlite_pool.get_nowait()
+        except queue.Empty:
+            return self._connect_sqlite()
+    
+    def _release_sqlite(self, conn):
+        """SQLite 接続を再利用キューに戻す（満杯ならクローズ）"""
+        try:
+            self._sqlite_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    
+    def _return_connection(self, conn):
+        """接続をプールに返却（トランザクション状態のリセットは返却側で行う）"""
+        # putconn が未完了トランザクションの rollback と状態不明な接続の破棄を行うため、
+        # 取得側では状態チェックを省略できる
+        conn.last_used_at = time.monotonic()
+        self.pool.putconn(conn)
+    
+    def _discard_connection(self, conn):
+        """問題のある接続のみをプールから破棄（他の健全な接続は維持）"""
+        if conn is None or not self.pool:
+            return
+        try:
+            self.pool.putconn(conn, close=True)
+        except Exception as e:
+            logger.warning("⚠️ Error discarding connection: %s", e)
+    
+    def _checkout_fresh(self):
+        """プールから接続を取得し、古い接続の作り直しと長時間アイドル接続の生存確認を行う"""
+        conn = self.pool.getconn()
+        now = time.monotonic()
+        
+        # 寿命を超えた接続は破棄して取り直す（pool_recycle 相当。新しく作られた接続に当たるまで繰り返す）
+        while now - conn.born_at > self.config.DB_POOL_RECYCLE:
+            logger.debug("♻️ Recycling connection past its max age")
+            self._discard_connection(conn)
+            conn = self.pool.getconn()
+        
+        # しばらく使われていなかった接続だけ ping する（毎回の往復は避ける）
+        if conn.last_used_at is not None and now - conn.last_used_at > self.config.DB_POOL_PRE_PING_IDLE:
+            try:
+                cursor = conn.cursor(cursor_factory=extensions.cursor)
+                cursor.execute('SELECT 1')
+                cursor.close()
+                conn.rollback()
+            except Exception:
+                # 呼び出し側で破棄・リトライさせるため接続を渡して再送出
+                self._discard_connection(conn)
+                raise
+        return conn
+    
+    def _record_connection_failure(self):
+        """接続失敗を記録し、時間窓内で連続失敗が閾値に達したらプールを再構築"""
+        with self._failure_lock:
+            now = time.monotonic()
+            if now - self._first_failure_at > _POOL_RESET_WINDOW:
+                self._consecutive_failures = 0
+                self._first_failure_at = now
+            self._consecutive_failures += 1
+            
+            if self._consecutive_failures < _POOL_RESET_THRESHOLD:
+                return
+            
+            logger.warning("🔄 %s consecutive connection failures, reinitializing pool...", self._consecutive_failures)
+            self._consecutive_failures = 0
+            try:
+                if self.pool:
+                    try:
+                        self.pool.closeall()
+                    except Exception as close_error:
+                        logger.warning("⚠️ Error closing pool: %s", close_error)
+                self._init_pool(allow_fallback=False)
+            except Exception as reinit_error:
+                logger.error("❌ Pool reinitialization failed: %s", reinit_error)
+    
+    def _record_connection_success(self):
+        """接続成功時に連続失敗カウンタをリセット"""
+        if self._consecutive_failures:
+            with self._failure_lock:
+                self._consecutive_failures = 0
+    
+    def _wait_before_retry(self, seconds):
+        """リトライ前に待機（シャットダウン要求があれば待機を打ち切って中断）"""
+        if self._shutdown_event.wait(seconds):
+            raise RuntimeError("Database manager is shutting down")
     
     def _get_connection_with_retry(self, max_retries=3):
         """再接続処理付きでコネクションを取得"""
         last_error = None
         
         for attempt in range(max_retries):
+            conn = None
             try:
                 if not self.pool:
                     raise RuntimeError("Database pool not initialized")
                 
-                # プールから接続を取得
-                conn = self.pool.getconn()
-                
-                # ✅ トランザクション状態をリセット（rollbackのみ）
-                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
-                    try:
-                        conn.rollback()
-                    except Exception as e:
-                        logger.warning(f"⚠️ Rollback during connection reset: {e}")
+                # プールから接続を取得（古い接続・長時間アイドル接続はここで検査）
+                conn = self._checkout_fresh()
                 
-                # 接続が有効かテスト
-                if not self._test_connection(conn):
-                    logger.warning(f"⚠️ Connection test failed on attempt {attempt + 1}")
-                    try:
-                        self.pool.putconn(conn, close=True)
-                    except Exception:
-                        pass
-                    raise psycopg2.OperationalError("Connection test failed")
+                # ✅ ローカルで判定できる状態のみチェック（状態リセットは返却時に実施済み）
+                if conn.closed:
+                    raise psycopg2.InterfaceError("Connection already closed")
                 
                 # ✅ autocommit設定を削除（デフォルトのまま使用）
-                logger.debug(f"✅ Connection acquired on attempt {attempt + 1}")
+                self._record_connection_success()
+                logger.debug("✅ Connection acquired on attempt %s", attempt + 1)
                 return conn
             
             except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
                 last_error = e
-                logger.warning(f"⚠️ Connection attempt {attempt + 1}/{max_retries} failed: {e}")
+                logger.warning("⚠️ Connection attempt %s/%s failed: %s", attempt + 1, max_retries, e)
+                
+                # 失敗した接続だけを破棄（プール全体は再構築しない）
+                self._discard_connection(conn)
+                self._record_connection_failure()
                 
                 if attempt < max_retries - 1:
-                    # バックオフ付きでリトライ
-                    sleep_time = 0.5 * (2 ** attempt)
-                    logger.info(f"⏳ Retrying in {sleep_time} seconds...")
-                    time.sleep(sleep_time)
-                    
-                    # プールを再初期化
-                    try:
-                        logger.info("🔄 Reinitializing connection pool...")
-                        if self.pool:
-                            try:
-                                self.pool.closeall()
-                            except Exception as close_error:
-                                logger.warning(f"⚠️ Error closing pool: {close_error}")
-                        self._init_pool()
-                    except Exception as reinit_error:
-                        logger.error(f"❌ Pool reinitialization failed: {reinit_error}")
+                    # ジッター付きバックオフでリトライ（ワーカー間で再試行タイミングを分散）
+                    sleep_time = _backoff_delay(attempt)
+                    logger.info("⏳ Retrying in %.2f seconds...", sleep_time)
+                    self._wait_before_retry(sleep_time)
             
             except Exception as e:
                 last_error = e
-                logger.error(f"❌ Unexpected error getting connection: {e}", exc_info=True)
+                logger.error("❌ Unexpected error getting connection: %s", e, exc_info=True)
                 if attempt < max_retries - 1:
-                    time.sleep(0.5 * (attempt + 1))
+                    self._wait_before_retry(_backoff_delay(attempt))
         
         # すべてのリトライが失敗
         raise RuntimeError(f"Failed to get database connection after {max_retries} retries: {last_error}")
@@ -123,110 +462,76 @@ class DatabaseManager:
     def get_db(self):
         """データベース接続を取得（PostgreSQLは必ずRealDictCursorを使用）"""
         if self.use_postgres:
-            conn = None
-            try:
-                # 再接続処理付きで接続取得
-                conn = self._get_connection_with_retry()
-                
-                # ✅ RealDictCursor用のカスタムコネクションクラス
-                class DictConnection:
-                    """RealDictCursorを常に返すラッパー"""
-                    def __init__(self, real_conn, manager):
-                        self._conn = real_conn
-                        self._manager = manager
-                        self._closed = False
-                    
-                    def cursor(self, *args, **kwargs):
-                        """常にRealDictCursorを返す"""
-                        if self._closed:
-                            raise psycopg2.InterfaceError("Connection already closed")
-                        return self._conn.cursor(cursor_factory=RealDictCursor)
+            # プールの空きを待ってから取得（満杯の getconn はエラーになるため、接続数を超える同時実行はここで待たせる）
+            with self._pool_slot():
+                conn = None
+                broken = False
+                try:
+                    # 再接続処理付きで接続取得
+                    conn = self._get_connection_with_retry()
                     
-                    def commit(self):
-                        if not self._closed:
-                            try:
-                                return self._conn.commit()
-                            except Exception as e:
-                                logger.error(f"❌ Commit error: {e}")
-                                raise
+                    # ✅ 既定のカーソルを RealDictCursor にする（ラッパーは不要）
+                    conn.cursor_factory = RealDictCursor
                     
-                    def rollback(self):
-                        if not self._closed:
-                            try:
-                                return self._conn.rollback()
-                            except Exception as e:
-                                logger.warning(f"⚠️ Rollback error: {e}")
+                    yield conn
                     
-                    def close(self):
-                        if not self._closed:
-                            self._closed = True
-                    
-                    def __enter__(self):
-                        return self
-                    
-                    def __exit__(self, exc_type, exc_val, exc_tb):
-                        if exc_type:
-                            try:
-                                self.rollback()
-                            except Exception as e:
-                                logger.warning(f"⚠️ Error during rollback in __exit__: {e}")
-                        else:
-                            # ✅ 正常終了時はコミット
-                            try:
-                                self.commit()
-                            except Exception as e:
-                                logger.error(f"❌ Error during commit in __exit__: {e}")
-                        self.close()
-                        return False
-                
-                wrapped_conn = DictConnection(conn, self)
-                logger.debug("✅ PostgreSQL connection with RealDictCursor wrapper")
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    logger.error("❌ Database connection error: %s", e, exc_info=True)
+                    # 実クエリで切断が判明した接続はプールに戻さず破棄する
+                    broken = True
+                    if conn:
+                        try:
+                            conn.rollback()
+                        except Exception:
+                            pass
+                    raise
                 
-                yield wrapped_conn
+                except Exception as e:
+                    logger.error("❌ Database error: %s", e, exc_info=True)
+                    if conn:
+                        try:
+                            conn.rollback()
+                        except Exception:
+                            pass
+                    raise
                 
-            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
-                logger.error(f"❌ Database connection error: {e}", exc_info=True)
-                if conn:
-                    try:
-                        conn.rollback()
-                    except Exception:
-                        pass
-                raise
-            
-            except Exception as e:
-                logger.error(f"❌ Database error: {e}", exc_info=True)
-                if conn:
-                    try:
-                        conn.rollback()
-                    except Exception:
-                        pass
-                raise
-            
-            finally:
-                if conn:
-                    try:
-                        # プールに接続を返却
-                        if self.pool:
-                            self.pool.putconn(conn)
-                            logger.debug("✅ Connection returned to pool")
-                    except Exception as e:
-                        logger.error(f"❌ Error returning connection to pool: {e}")
+                finally:
+                    if conn:
+                        try:
+                            # プールに接続を返却（切断済みの接続は破棄）
+                            if self.pool:
+                                if broken or conn.closed:
+                                    self._discard_connection(conn)
+                                else:
+                                    self._return_connection(conn)
+                                    logger.debug("✅ Connection returned to pool")
+                        except Exception as e:
+                            logger.error("❌ Error returning connection to pool: %s", e)
         else:
-            # SQLite: タイムアウトを30秒に延長（ロック対策）
-            conn = sqlite3.connect('portfolio.db', timeout=30.0)
-            conn.row_factory = sqlite3.Row
+            # SQLite: 接続を再利用して毎回の open/PRAGMA を省略
+            conn = self._acquire_sqlite()
             try:
                 yield conn
-                conn.commit()
+                # 書き込みがあった場合のみコミット（読み取りのみならスキップ）
+                if conn.in_transaction:
+                    conn.commit()
             except Exception as e:
                 conn.rollback()
-                logger.error(f"❌ SQLite error: {e}", exc_info=True)
+                logger.error("❌ SQLite error: %s", e, exc_info=True)
                 raise
             finally:
-                conn.close()
+                self._release_sqlite(conn)
+    
+    def batch_cursor(self, conn):
+        """一括書き込み用のカーソルを取得（PostgreSQLは行を辞書化しない素のカーソル）"""
+        if self.use_postgres:
+            return conn.cursor(cursor_factory=extensions.cursor)
+        return conn.cursor()
     
     def health_check(self):
         """データベース接続の健全性チェック"""
+        if self.use_postgres:
+            return self._postgres_health_check()
         try:
             with self.get_db() as conn:
                 c = conn.cursor()
@@ -234,7 +539,27 @@ class DatabaseManager:
                 result = c.fetchone()
                 return result is not None
         except Exception as e:
-            logger.error(f"❌ Health check failed: {e}")
+            logger.error("❌ Health check failed: %s", e)
+            return False
+    
+    def _postgres_health_check(self):
+        """PostgreSQL の高速ヘルスチェック（リトライ・辞書カーソルなしで即時に失敗を返す）"""
+        if not self.pool:
+            return False
+        conn = None
+        try:
+            with self._pool_slot(timeout=5):
+                conn = self.pool.getconn()
+                cursor = conn.cursor(cursor_factory=extensions.cursor)
+                cursor.execute('SELECT 1')
+                result = cursor.fetchone()
+                cursor.close()
+                self._return_connection(conn)
+                conn = None
+            return result is not None
+        except Exception as e:
+            logger.error("❌ Health check failed: %s", e)
+            self._discard_connection(conn)
             return False
     
     def init_database(self):
@@ -258,7 +583,7 @@ class DatabaseManager:
                     return
             
             except Exception as e:
-                logger.error(f"❌ Database initialization attempt {attempt + 1}/{max_retries} failed: {e}")
+                logger.error("❌ Database initialization attempt %s/%s failed: %s", attempt + 1, max_retries, e)
                 if attempt < max_retries - 1:
                     time.sleep(2 ** attempt)
                 else:
@@ -267,56 +592,23 @@ class DatabaseManager:
     def _init_postgres(self, cursor, conn):
         """PostgreSQL テーブル作成"""
         try:
-            logger.info("✅ Creating PostgreSQL tables...")
+            # ✅ 複数ワーカーの同時初期化を防止（トランザクション終了時に自動解放）
+            # 他のワーカーが初期化中なら完了まで待つ（テーブル作成前にリクエストを受け付けない）
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', (_SCHEMA_LOCK_ID,))
             
-            # usersテーブル
-            cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(255) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )''')
+            # ✅ スキーマが最新ならDDLをすべてスキップ（ロック取得後に確認するので、待っていた側はここで抜ける）
+            cursor.execute("SELECT to_regclass('public.schema_version') AS tbl")
+            if cursor.fetchone()['tbl']:
+                cursor.execute('SELECT MAX(version) AS version FROM schema_version')
+                row = cursor.fetchone()
+                if row and row['version'] == SCHEMA_VERSION:
+                    logger.info("ℹ️ Schema is up to date (version %s), skipping DDL", SCHEMA_VERSION)
+                    return
             
-            # assetsテーブル（display_order追加）
-            cursor.execute('''CREATE TABLE IF NOT EXISTS assets (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                asset_type VARCHAR(50) NOT NULL,
-                symbol VARCHAR(50) NOT NULL,
-                name VARCHAR(255),
-                quantity DOUBLE PRECISION NOT NULL,
-                price DOUBLE PRECISION DEFAULT 0,
-                avg_cost DOUBLE PRECISION DEFAULT 0,
-                display_order INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )''')
+            logger.info("✅ Creating PostgreSQL tables...")
             
-            # asset_historyテーブル
-            cursor.execute('''CREATE TABLE IF NOT EXISTS asset_history (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                record_date DATE NOT NULL,
-                jp_stock_value DOUBLE PRECISION DEFAULT 0,
-                us_stock_value DOUBLE PRECISION DEFAULT 0,
-                cash_value DOUBLE PRECISION DEFAULT 0,
-                gold_value DOUBLE PRECISION DEFAULT 0,
-                crypto_value DOUBLE PRECISION DEFAULT 0,
-                investment_trust_value DOUBLE PRECISION DEFAULT 0,
-                insurance_value DOUBLE PRECISION DEFAULT 0,
-                total_value DOUBLE PRECISION DEFAULT 0,
-                prev_jp_stock_value DOUBLE PRECISION DEFAULT 0,
-                prev_us_stock_value DOUBLE PRECISION DEFAULT 0,
-                prev_cash_value DOUBLE PRECISION DEFAULT 0,
-                prev_gold_value DOUBLE PRECISION DEFAULT 0,
-                prev_crypto_value DOUBLE PRECISION DEFAULT 0,
-                prev_investment_trust_value DOUBLE PRECISION DEFAULT 0,
-                prev_insurance_value DOUBLE PRECISION DEFAULT 0,
-                prev_total_value DOUBLE PRECISION DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
-                UNIQUE(user_id, record_date)
-            )''')
+            # テーブル・インデックスを1回の往復でまとめて作成
+            cursor.execute(SCHEMA_DDL_PG)
             
             # ✅ スキーママイグレーション（PostgreSQL）
             # 新しいカラムが存在するか確認し、なければ追加する
@@ -332,44 +624,33 @@ class DatabaseManager:
             
             for col in history_columns:
                 if col not in existing_history_cols:
-                    logger.info(f"🔄 Migrating: Adding missing column '{col}' to asset_history")
+                    logger.info("🔄 Migrating: Adding missing column '%s' to asset_history", col)
                     cursor.execute(f"ALTER TABLE asset_history ADD COLUMN {col} DOUBLE PRECISION DEFAULT 0")
-
-            # 2. assets の display_order カラム
-            cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'assets'")
-            existing_assets_cols = [row['column_name'] for row in cursor.fetchall()]
             
-            if 'display_order' not in existing_assets_cols:
-                logger.info("🔄 Migrating: Adding 'display_order' column to assets table")
-                cursor.execute("ALTER TABLE assets ADD COLUMN display_order INTEGER DEFAULT 0")
-            
-            # インデックス作成
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_assets_user_id ON assets(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_assets_user_type ON assets(user_id, asset_type)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_asset_history_user_id ON asset_history(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_asset_history_user_date ON asset_history(user_id, record_date)')
+            # assets の display_order / last_price_update は SCHEMA_DDL_PG 内の ADD COLUMN IF NOT EXISTS で追加済み
             
             logger.info("✅ PostgreSQL tables created")
             
             # デモユーザー作成
-            from werkzeug.security import generate_password_hash
-            
             cursor.execute("SELECT id, username FROM users WHERE username = %s", ('demo',))
             existing_demo = cursor.fetchone()
             
             if not existing_demo:
-                demo_hash = generate_password_hash('demo123')
-                logger.info(f"🔐 Creating demo user")
+                demo_hash = _DEMO_PASSWORD_HASH
+                logger.info("🔐 Creating demo user")
                 cursor.execute("INSERT INTO users (username, password_hash) VALUES (%s, %s)",
                              ('demo', demo_hash))
                 logger.info("✅ Demo user created: demo/demo123")
             else:
-                logger.info(f"ℹ️ Demo user already exists (ID: {existing_demo['id']})")
+                logger.info("ℹ️ Demo user already exists (ID: %s)", existing_demo['id'])
+            
+            cursor.execute('INSERT INTO schema_version (version) VALUES (%s) ON CONFLICT DO NOTHING',
+                         (SCHEMA_VERSION,))
             
             logger.info("✅ PostgreSQL database initialized successfully")
         
         except Exception as e:
-            logger.error(f"❌ Error initializing PostgreSQL: {e}", exc_info=True)
+            logger.error("❌ Error initializing PostgreSQL: %s", e, exc_info=True)
             raise
     
     def _init_sqlite(self, cursor, conn):
@@ -377,51 +658,8 @@ class DatabaseManager:
         try:
             logger.info("✅ Creating SQLite tables...")
             
-            cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )''')
-            
-            cursor.execute('''CREATE TABLE IF NOT EXISTS assets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                asset_type TEXT NOT NULL,
-                symbol TEXT NOT NULL,
-                name TEXT,
-                quantity REAL NOT NULL,
-                price REAL DEFAULT 0,
-                avg_cost REAL DEFAULT 0,
-                display_order INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )''')
-            
-            cursor.execute('''CREATE TABLE IF NOT EXISTS asset_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                record_date DATE NOT NULL,
-                jp_stock_value REAL DEFAULT 0,
-                us_stock_value REAL DEFAULT 0,
-                cash_value REAL DEFAULT 0,
-                gold_value REAL DEFAULT 0,
-                crypto_value REAL DEFAULT 0,
-                investment_trust_value REAL DEFAULT 0,
-                insurance_value REAL DEFAULT 0,
-                total_value REAL DEFAULT 0,
-                prev_jp_stock_value REAL DEFAULT 0,
-                prev_us_stock_value REAL DEFAULT 0,
-                prev_cash_value REAL DEFAULT 0,
-                prev_gold_value REAL DEFAULT 0,
-                prev_crypto_value REAL DEFAULT 0,
-                prev_investment_trust_value REAL DEFAULT 0,
-                prev_insurance_value REAL DEFAULT 0,
-                prev_total_value REAL DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
-                UNIQUE(user_id, record_date)
-            )''')
+            # テーブルを1回の往復でまとめて作成（インデックスはマイグレーション後）
+            cursor.executescript(SCHEMA_DDL_SQLITE)
             
             # ✅ スキーママイグレーション（SQLite）
             
@@ -437,7 +675,7 @@ class DatabaseManager:
             
             for col in history_columns:
                 if col not in existing_history_cols:
-                    logger.info(f"🔄 Migrating: Adding missing column '{col}' to asset_history")
+                    logger.info("🔄 Migrating: Adding missing column '%s' to asset_history", col)
                     cursor.execute(f"ALTER TABLE asset_history ADD COLUMN {col} REAL DEFAULT 0")
 
             # 2. assets の display_order カラム
@@ -448,36 +686,48 @@ class DatabaseManager:
                 logger.info("🔄 Migrating: Adding 'display_order' column to assets table")
                 cursor.execute("ALTER TABLE assets ADD COLUMN display_order INTEGER DEFAULT 0")
             
-            # インデックス作成
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_assets_user_id ON assets(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_assets_user_type ON assets(user_id, asset_type)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_asset_history_user_id ON asset_history(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_asset_history_user_date ON asset_history(user_id, record_date)')
+            # 3. assets の last_price_update カラム
+            if 'last_price_update' not in existing_assets_cols:
+                logger.info("🔄 Migrating: Adding 'last_price_update' column to assets table")
+                cursor.execute("ALTER TABLE assets ADD COLUMN last_price_update TIMESTAMP")
+            
+            # 4. users の data_version カラム（ダッシュボードキャッシュの有効性判定用）
+            cursor.execute("PRAGMA table_info(users)")
+            if 'data_version' not in [row['name'] for row in cursor.fetchall()]:
+                logger.info("🔄 Migrating: Adding 'data_version' column to users table")
+                cursor.execute("ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0")
+            
+            # 5. インデックス（既存DBでも上のカラム追加後に作成する）
+            cursor.executescript(SCHEMA_INDEXES_SQLITE)
             
             logger.info("✅ SQLite tables created")
             
             # デモユーザー作成
-            from werkzeug.security import generate_password_hash
-            
             cursor.execute("SELECT id FROM users WHERE username = ?", ('demo',))
             if not cursor.fetchone():
-                demo_hash = generate_password_hash('demo123')
+                demo_hash = _DEMO_PASSWORD_HASH
                 cursor.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)",
                              ('demo', demo_hash))
                 logger.info("✅ Demo user created: demo/demo123")
         
         except Exception as e:
-            logger.error(f"❌ Error initializing SQLite: {e}", exc_info=True)
+            logger.error("❌ Error initializing SQLite: %s", e, exc_info=True)
             raise
     
     def close_pool(self):
         """コネクションプールをクローズ"""
+        self._shutdown_event.set()
         if self.pool:
             try:
                 self.pool.closeall()
                 logger.info("✅ Connection pool closed")
             except Exception as e:
-                logger.error(f"❌ Error closing connection pool: {e}")
+                logger.error("❌ Error closing connection pool: %s", e)
+        while True:
+            try:
+                self._sqlite_pool.get_nowait().close()
+            except queue.Empty:
+                break
 
 # グローバルデータベースマネージャー
 db_manager = DatabaseManager()
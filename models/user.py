@@ -8,9 +8,26 @@
 ユーザーデータモデルとパスワード管理を提供
 """
 
-from werkzeug.security import generate_password_hash, check_password_hash
+import hmac
+import hashlib
+import logging
+import os
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
-from utils import logger
+from utils import logger, hash_password, hash_passwords, verify_password
+from utils.cache import SimpleCache
+
+# 日本標準時
+_JST = timezone(timedelta(hours=9))
+
+# 存在しないユーザーでも検証時間を揃えるためのダミーハッシュ
+# ※新規ユーザーと同じ方式（argon2 があれば argon2id）で作るため、揃うのは新しい形式のユーザーとの比較のみ。
+#   werkzeug 形式（pbkdf2 / scrypt）のままの既存ユーザーは検証コストが異なり、パスワードを変更して
+#   再ハッシュされるまでは応答時間からユーザーの有無を推測できる余地が残る
+_DUMMY_HASH = hash_password('dummy-password-for-timing')
+
+# 認証済みキャッシュのキー生成用（プロセス内限定なので起動ごとに生成）
+_AUTH_CACHE_PEPPER = os.urandom(32)
 
 # ================================================================================
 # 👤 ユーザーモデル
@@ -19,37 +36,40 @@ from utils import logger
 class User:
     """ユーザークラス"""
     
+    __slots__ = ('id', 'username', 'password_hash', 'created_at')
+    
     def __init__(self, id, username, password_hash, created_at=None):
         self.id = id
         self.username = username
         self.password_hash = password_hash
-        self.created_at = created_at or self._get_current_time()
+        self.created_at = created_at if created_at is not None else self._get_current_time()
     
     @staticmethod
     def _get_current_time():
         """現在時刻を取得（JST）"""
-        jst = timezone(timedelta(hours=9))
-        return datetime.now(jst)
+        return datetime.now(_JST)
     
     def set_password(self, password):
         """パスワードをハッシュ化して設定"""
         if not password or len(password) < 6:
             raise ValueError("Password must be at least 6 characters long")
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
         """入力されたパスワードが正しいか確認"""
         if not password or not self.password_hash:
-            logger.error(f"❌ Password check failed: password={bool(password)}, hash={bool(self.password_hash)}")
+            logger.error("❌ Password check failed: password=%s, hash=%s", bool(password), bool(self.password_hash))
             return False
         try:
-            logger.info(f"🔑 Checking password for user {self.username}")
-            logger.info(f"🔑 Hash preview: {self.password_hash[:50]}...")
-            result = check_password_hash(self.password_hash, password)
-            logger.info(f"🔑 Password check result: {result}")
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                logger.debug("🔑 Checking password for user %s", self.username)
+            result = verify_password(self.password_hash, password)
+            if debug:
+                logger.debug("🔑 Password check result: %s", result)
             return result
         except Exception as e:
-            logger.error(f"❌ Error checking password: {e}", exc_info=True)
+            logger.error("❌ Error checking password: %s", e, exc_info=True)
             return False
     
     def to_dict(self):
@@ -67,35 +87,53 @@ class User:
 # 🔧 ユーティリティ関数
 # ================================================================================
 
-def row_to_dict(row):
-    """SQLite Row または PostgreSQL の dict-like オブジェクトを dict に変換"""
+def row_to_dict(row, keys=None):
+    """SQLite Row または PostgreSQL の dict-like オブジェクトを dict に変換
+    
+    keys を渡すと（結果セット全体で共通のカラム名）、行ごとの keys() 呼び出しを省略する
+    """
     if row is None:
         logger.error("❌ row_to_dict: row is None")
         return None
     
+    # ✅ 高速パス: RealDictRow などの辞書はそのまま返す
+    if type(row) is dict or isinstance(row, dict):
+        return row
+    
+    # ✅ 高速パス: 呼び出し側で取得済みのカラム名を使用
+    if keys is not None:
+        return dict(zip(keys, row))
+    
     try:
-        logger.info(f"🔍 row_to_dict: row type = {type(row)}")
-        
-        # PostgreSQL の RealDictCursor の場合（既に辞書型）
-        if isinstance(row, dict):
-            logger.info(f"✅ row_to_dict: Already a dict with keys: {list(row.keys())}")
-            return row
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("🔍 row_to_dict: row type = %s", type(row))
         
         # SQLite の Row オブジェクトまたは psycopg2 の tuple-like オブジェクト
         if hasattr(row, 'keys'):
             result = dict(zip(row.keys(), row))
-            logger.info(f"✅ row_to_dict: Converted to dict with keys: {list(result.keys())}")
+            if debug:
+                logger.debug("✅ row_to_dict: Converted to dict with keys: %s", list(result.keys()))
             return result
         
         # その他のタプル形式
         result = dict(row) if hasattr(row, '__iter__') else row
-        logger.info(f"✅ row_to_dict: Fallback conversion, type: {type(result)}")
+        if debug:
+            logger.debug("✅ row_to_dict: Fallback conversion, type: %s", type(result))
         return result
         
     except Exception as e:
-        logger.error(f"❌ Error converting row to dict: {e}, row type: {type(row)}", exc_info=True)
+        logger.error("❌ Error converting row to dict: %s, row type: %s", e, type(row), exc_info=True)
         return None
 
+def _row_to_user(row):
+    """ユーザー行（id, username, password_hash の順）から直接 User を生成"""
+    if isinstance(row, dict):
+        return User(row['id'], row['username'], row['password_hash'])
+    # タプル行は _get_user_columns の順序で展開（中間 dict を作らない）
+    uid, uname, phash = row
+    return User(uid, uname, phash)
+
 # ================================================================================
 # 🔐 ユーザーサービス（DB操作）
 # ================================================================================
@@ -103,96 +141,221 @@ def row_to_dict(row):
 class UserService:
     """ユーザー関連のDB操作を管理"""
     
-    def __init__(self, db_manager, use_postgres=False):
+    # users(username) のユニークインデックス確認はプロセスで一度だけ
+    _indexes_checked = False
+    
+    def __init__(self, db_manager, use_postgres=False, debug_dump_users=False):
         self.db_manager = db_manager
         self.use_postgres = use_postgres
-        logger.info(f"🔧 UserService initialized: use_postgres={use_postgres}")
+        # ユーザー未検出時に既存ユーザー名を出力するか（デバッグ専用）
+        self.debug_dump_users = debug_dump_users
+        # ユーザー行のプロセス内キャッシュ（セッションからの参照用）
+        # 破棄は処理したワーカーにしか届かないため、他ワーカーでの変更・削除が数十秒で反映されるよう短くする。
+        # パスワードの検証・変更ではこのキャッシュを使わず、常に DB の password_hash を読む
+        self._user_by_name = SimpleCache(duration=30, maxsize=10000)
+        self._user_by_id = SimpleCache(duration=30, maxsize=10000)
+        # 検証に成功した資格情報（平文は保持せず HMAC のみ）
+        self._auth_cache = SimpleCache(duration=3600, maxsize=10000)
+        self._build_sql()
+        self._ensure_indexes()
+        logger.info("🔧 UserService initialized: use_postgres=%s", use_postgres)
     
     def _get_user_columns(self):
         """使用可能なカラムを取得"""
         return "id, username, password_hash"
     
+    def _ensure_indexes(self):
+        """username 検索がインデックスを使えることを確認し、無ければ作成する
+        
+        通常は UNIQUE 制約のインデックスがあるので何もしない（重複インデックスは作らない）
+        """
+        if UserService._indexes_checked:
+            return
+        try:
+            with self.db_manager.get_db() as conn:
+                c = conn.cursor()
+                if self.use_postgres:
+                    c.execute("""
+                        SELECT 1 FROM pg_index i
+                        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                        WHERE i.indrelid = 'users'::regclass AND i.indisunique
+                          AND i.indnatts = 1 AND a.attname = 'username'
+                    """)
+                else:
+                    c.execute("""
+                        SELECT 1 FROM pragma_index_list('users') AS il, pragma_index_info(il.name) AS ii
+                        WHERE il."unique" = 1 AND ii.name = 'username'
+                    """)
+                if c.fetchone() is None:
+                    logger.warning("⚠️ No unique index on users(username), creating one")
+                    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username)')
+                conn.commit()
+            UserService._indexes_checked = True
+        except Exception as e:
+            logger.warning("⚠️ Could not verify users(username) index: %s", e)
+    
+    @contextmanager
+    def transaction(self):
+        """複数の操作を1接続・1トランザクションにまとめる
+        
+        with service.transaction() as conn: の形で使い、正常終了時にコミット、例外時にロールバックする
+        """
+        with self.db_manager.get_db() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def _build_sql(self):
+        """DB種別に応じたSQL文を初期化時に一度だけ組み立てる"""
+        ph = '%s' if self.use_postgres else '?'
+        cols = self._get_user_columns()
+        self._SQL_GET_BY_ID = f'SELECT {cols} FROM users WHERE id = {ph}'
+        self._SQL_GET_BY_NAME = f'SELECT {cols} FROM users WHERE username = {ph}'
+        self._SQL_PAGE_FIRST = f'SELECT {cols} FROM users ORDER BY id DESC LIMIT {ph}'
+        self._SQL_PAGE_AFTER = f'SELECT {cols} FROM users WHERE id < {ph} ORDER BY id DESC LIMIT {ph}'
+        if self.use_postgres:
+            self._SQL_INSERT = 'INSERT INTO users (username, password_hash) VALUES (%s, %s) ON CONFLICT (username) DO NOTHING RETURNING id'
+        else:
+            # RETURNING は SQLite 3.35 以降
+            self._SQL_INSERT = 'INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?) RETURNING id'
+        if self.use_postgres:
+            self._SQL_BULK_INSERT = 'INSERT INTO users (username, password_hash) VALUES (%s, %s) ON CONFLICT (username) DO NOTHING'
+        else:
+            self._SQL_BULK_INSERT = 'INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)'
+        self._SQL_UPDATE_PASSWORD = f'UPDATE users SET password_hash = {ph} WHERE id = {ph}'
+        self._SQL_DELETE = f'DELETE FROM users WHERE id = {ph}'
+        
+        # 複数ID検索: PostgreSQL は配列1つ、SQLite はID数ぶんのプレースホルダ
+        if self.use_postgres:
+            sql_by_ids = f'SELECT {cols} FROM users WHERE id = ANY(%s)'
+            self._execute_get_by_ids = lambda c, ids: c.execute(sql_by_ids, (ids,))
+        else:
+            sql_by_ids = f'SELECT {cols} FROM users WHERE id IN ' + '({})'
+            self._execute_get_by_ids = lambda c, ids: c.execute(sql_by_ids.format(','.join('?' * len(ids))), ids)
+    
+    def _cache_user(self, user):
+        """ユーザーを ID・ユーザー名の両方のキャッシュに登録"""
+        self._user_by_id.set(user.id, user)
+        self._user_by_name.set(user.username, user)
+    
+    @staticmethod
+    def _auth_cache_key(user, password):
+        """認証済みキャッシュのキー（ハッシュを含むのでパスワード変更で自動的に無効化）"""
+        message = f"{user.id}\0{user.password_hash}\0{password}".encode('utf-8')
+        return hmac.new(_AUTH_CACHE_PEPPER, message, hashlib.sha256).digest()
+    
+    def _invalidate_user(self, user_id, username=None):
+        """ユーザーのキャッシュを破棄"""
+        cached = self._user_by_id.get(user_id)
+        self._user_by_id.delete(user_id)
+        if cached:
+            self._user_by_name.delete(cached.username)
+        if username:
+            self._user_by_name.delete(username)
+    
+    def _debug_list_users(self, c):
+        """デバッグ用: 既存ユーザー名を先頭20件だけ表示"""
+        c.execute('SELECT username FROM users ORDER BY id LIMIT 20')
+        all_users = [r[0] if isinstance(r, tuple) else r['username'] for r in c.fetchall()]
+        logger.debug("📋 Available users in DB (first 20): %s", all_users)
+    
     def get_user_by_id(self, user_id):
         """IDでユーザーを取得"""
+        cached = self._user_by_id.get(user_id)
+        if cached:
+            return cached
+        return self._fetch_user_by_id(user_id)
+    
+    def _fetch_user_by_id(self, user_id):
+        """IDでユーザーを DB から取得（キャッシュを経由せず、結果でキャッシュを更新）"""
         try:
             with self.db_manager.get_db() as conn:
                 c = conn.cursor()
                 
-                if self.use_postgres:
-                    c.execute(f'SELECT {self._get_user_columns()} FROM users WHERE id = %s', (user_id,))
-                else:
-                    c.execute(f'SELECT {self._get_user_columns()} FROM users WHERE id = ?', (user_id,))
+                c.execute(self._SQL_GET_BY_ID, (user_id,))
                 
                 row = c.fetchone()
                 
                 if row:
-                    row_dict = row_to_dict(row)
-                    if row_dict:
-                        return User(
-                            row_dict['id'],
-                            row_dict['username'],
-                            row_dict['password_hash']
-                        )
+                    user = _row_to_user(row)
+                    self._cache_user(user)
+                    return user
                 return None
         except Exception as e:
-            logger.error(f"❌ Error getting user by id: {e}", exc_info=True)
+            logger.error("❌ Error getting user by id: %s", e, exc_info=True)
             return None
     
+    def get_users_by_ids(self, user_ids):
+        """複数IDのユーザーを1クエリでまとめて取得（{id: User} を返す）"""
+        users = {}
+        missing = []
+        for user_id in set(user_ids):
+            cached = self._user_by_id.get(user_id)
+            if cached:
+                users[user_id] = cached
+            else:
+                missing.append(user_id)
+        
+        if not missing:
+            return users
+        
+        try:
+            with self.db_manager.get_db() as conn:
+                c = conn.cursor()
+                
+                self._execute_get_by_ids(c, missing)
+                
+                for row in c.fetchall():
+                    user = _row_to_user(row)
+                    self._cache_user(user)
+                    users[user.id] = user
+            
+            return users
+        except Exception as e:
+            logger.error("❌ Error getting users by ids: %s", e, exc_info=True)
+            return users
+    
     def get_user_by_username(self, username):
         """ユーザー名でユーザーを取得"""
+        cached = self._user_by_name.get(username)
+        if cached:
+            return cached
+        return self._fetch_user_by_username(username)
+    
+    def _fetch_user_by_username(self, username):
+        """ユーザー名でユーザーを DB から取得（キャッシュを経由せず、結果でキャッシュを更新）"""
         try:
-            logger.info(f"🔍 Searching for user: {username}")
-            logger.info(f"🔍 Database mode: {'PostgreSQL' if self.use_postgres else 'SQLite'}")
+            logger.debug("🔍 Searching for user: %s", username)
             
             with self.db_manager.get_db() as conn:
                 c = conn.cursor()
                 
-                if self.use_postgres:
-                    c.execute(f'SELECT {self._get_user_columns()} FROM users WHERE username = %s', (username,))
-                else:
-                    c.execute(f'SELECT {self._get_user_columns()} FROM users WHERE username = ?', (username,))
+                c.execute(self._SQL_GET_BY_NAME, (username,))
                 
                 row = c.fetchone()
                 
                 if row is None:
-                    logger.warning(f"❌ User not found in database: {username}")
-                    # デバッグ: 全ユーザーを表示
-                    if self.use_postgres:
-                        c.execute('SELECT username FROM users')
-                    else:
-                        c.execute('SELECT username FROM users')
-                    all_users = [r[0] if isinstance(r, tuple) else r['username'] for r in c.fetchall()]
-                    logger.info(f"📋 Available users in DB: {all_users}")
-                    return None
-                
-                logger.info(f"✅ Row fetched for {username}, type: {type(row)}")
-                
-                row_dict = row_to_dict(row)
-                if not row_dict:
-                    logger.error(f"❌ Failed to convert row to dict for user: {username}")
+                    logger.warning("❌ User not found in database: %s", username)
+                    if self.debug_dump_users and logger.isEnabledFor(logging.DEBUG):
+                        self._debug_list_users(c)
                     return None
                 
-                logger.info(f"✅ User dict created with keys: {list(row_dict.keys())}")
-                logger.info(f"✅ User ID: {row_dict.get('id')}, Username: {row_dict.get('username')}")
-                logger.info(f"🔑 Password hash preview: {row_dict.get('password_hash', '')[:50]}...")
-                
-                user = User(
-                    row_dict['id'],
-                    row_dict['username'],
-                    row_dict['password_hash']
-                )
-                
-                logger.info(f"✅ User object created: {user}")
+                user = _row_to_user(row)
+                logger.debug("✅ User loaded: id=%s", user.id)
+                self._cache_user(user)
                 return user
                 
         except Exception as e:
-            logger.error(f"❌ Error getting user by username: {e}", exc_info=True)
+            logger.error("❌ Error getting user by username: %s", e, exc_info=True)
             return None
     
     def create_user(self, username, password):
         """新規ユーザーを作成"""
         try:
-            logger.info(f"👤 Creating user: {username}")
+            logger.info("👤 Creating user: %s", username)
             
             # バリデーション
             if not username or len(username) < 3:
@@ -201,146 +364,183 @@ class UserService:
             if not password or len(password) < 6:
                 raise ValueError("Password must be at least 6 characters")
             
-            # ユーザーが既に存在するか確認
-            existing_user = self.get_user_by_username(username)
-            if existing_user:
-                logger.warning(f"⚠️ User already exists: {username}")
-                raise ValueError("Username already exists")
-            
             # パスワードをハッシュ化
-            password_hash = generate_password_hash(password)
-            logger.info(f"🔐 Password hashed for user: {username}, hash preview: {password_hash[:50]}...")
+            password_hash = hash_password(password)
             
             # DBに保存
             with self.db_manager.get_db() as conn:
                 c = conn.cursor()
                 
-                if self.use_postgres:
-                    c.execute(
-                        'INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id',
-                        (username, password_hash)
-                    )
-                    result = c.fetchone()
-                    new_user_id = result[0] if result else None
-                else:
-                    c.execute(
-                        'INSERT INTO users (username, password_hash) VALUES (?, ?)',
-                        (username, password_hash)
-                    )
-                    new_user_id = c.lastrowid
-                
+                # 存在確認と挿入を1文で行う（重複時は行が返らない）
+                c.execute(self._SQL_INSERT, (username, password_hash))
+                result = c.fetchone()
                 conn.commit()
             
-            logger.info(f"✅ User created: {username} (ID: {new_user_id})")
+            if result is None:
+                logger.warning("⚠️ User already exists: %s", username)
+                raise ValueError("Username already exists")
+            
+            new_user_id = result['id']
+            self._cache_user(User(new_user_id, username, password_hash))
+            
+            logger.info("✅ User created: %s (ID: %s)", username, new_user_id)
             return True
         
+        except ValueError:
+            # 入力検証エラーは想定内なのでトレースバックは記録しない
+            raise
         except Exception as e:
-            logger.error(f"❌ Error creating user: {e}", exc_info=True)
+            logger.error("❌ Error creating user: %s", e, exc_info=True)
+            raise
+    
+    def bulk_create_users(self, pairs):
+        """(username, password) の組をまとめて作成（1接続・1コミット）
+        
+        既存のユーザー名はスキップし、作成した件数を返す
+        """
+        pairs = list(pairs)
+        for username, password in pairs:
+            if not username or len(username) < 3:
+                raise ValueError("Username must be at least 3 characters")
+            if not password or len(password) < 6:
+                raise ValueError("Password must be at least 6 characters")
+        
+        try:
+            # CPU負荷の高いハッシュ化はネイティブスレッドで並列実行（gevent ワーカーではハブのスレッドプール）
+            hashes = hash_passwords(p for _, p in pairs)
+            rows = [(username, password_hash) for (username, _), password_hash in zip(pairs, hashes)]
+            
+            with self.transaction() as conn:
+                c = conn.cursor()
+                c.executemany(self._SQL_BULK_INSERT, rows)
+                created = c.rowcount
+            
+            logger.info("✅ Bulk created %s/%s users", created, len(rows))
+            return created
+        
+        except Exception as e:
+            logger.error("❌ Error bulk creating users: %s", e, exc_info=True)
             raise
     
     def verify_user(self, username, password):
         """ユーザーの認証"""
         try:
-            logger.info(f"🔐 === Starting verification for user: {username} ===")
-            
-            user = self.get_user_by_username(username)
+            # 他のワーカーでのパスワード変更・削除を反映するため、password_hash は毎回 DB から読む
+            user = self._fetch_user_by_username(username)
             
             if not user:
-                logger.warning(f"❌ Verification failed: user not found - {username}")
+                # ユーザー有無をタイミングで判別されないよう同じコストの検証を行う
+                verify_password(_DUMMY_HASH, password or '')
+                logger.warning("❌ Verification failed: user not found - %s", username)
+                return False
+            
+            if not password:
                 return False
             
-            logger.info(f"✅ User object retrieved: {user}")
-            logger.info(f"🔑 User has password_hash: {bool(user.password_hash)}")
+            # 直近に検証済みの資格情報なら低速なハッシュ計算を省略
+            auth_key = self._auth_cache_key(user, password)
+            if self._auth_cache.get(auth_key):
+                return True
             
             # パスワードチェック
             is_valid = user.check_password(password)
-            logger.info(f"🔑 Final verification result: {'✅ VALID' if is_valid else '❌ INVALID'} for user {username}")
-            logger.info(f"🔐 === Verification complete for user: {username} ===")
+            logger.debug("🔑 Verification result for %s: %s", username, is_valid)
+            if is_valid:
+                self._auth_cache.set(auth_key, True)
             
             return is_valid
         except Exception as e:
-            logger.error(f"❌ Error verifying user {username}: {e}", exc_info=True)
+            logger.error("❌ Error verifying user %s: %s", username, e, exc_info=True)
             return False
     
     def update_password(self, user_id, old_password, new_password):
         """パスワードを更新"""
         try:
-            user = self.get_user_by_id(user_id)
+            user = self._fetch_user_by_id(user_id)
             
             if not user:
                 raise ValueError("User not found")
             
+            # パスワード変更は認証済みキャッシュを使わず毎回ハッシュで検証する
             if not user.check_password(old_password):
                 raise ValueError("Old password is incorrect")
             
             if len(new_password) < 6:
                 raise ValueError("New password must be at least 6 characters")
             
+            # キャッシュ上のオブジェクトを書き換えるため先に破棄しておく
+            self._invalidate_user(user_id, user.username)
             user.set_password(new_password)
             
             with self.db_manager.get_db() as conn:
                 c = conn.cursor()
                 
-                if self.use_postgres:
-                    c.execute(
-                        'UPDATE users SET password_hash = %s WHERE id = %s',
-                        (user.password_hash, user_id)
-                    )
-                else:
-                    c.execute(
-                        'UPDATE users SET password_hash = ? WHERE id = ?',
-                        (user.password_hash, user_id)
-                    )
+                c.execute(self._SQL_UPDATE_PASSWORD, (user.password_hash, user_id))
                 
                 conn.commit()
             
-            logger.info(f"✅ Password updated for user {user_id}")
+            self._invalidate_user(user_id, user.username)
+            
+            logger.info("✅ Password updated for user %s", user_id)
             return True
         
+        except ValueError:
+            # 入力検証エラーは想定内なのでトレースバックは記録しない
+            raise
         except Exception as e:
-            logger.error(f"❌ Error updating password: {e}", exc_info=True)
+            logger.error("❌ Error updating password: %s", e, exc_info=True)
             raise
     
     def delete_user(self, user_id):
         """ユーザーを削除"""
         try:
+            # ユーザー名のキャッシュも破棄するため削除前に取得しておく
+            user = self.get_user_by_id(user_id)
+            
             with self.db_manager.get_db() as conn:
                 c = conn.cursor()
                 
-                if self.use_postgres:
-                    c.execute('DELETE FROM users WHERE id = %s', (user_id,))
-                else:
-                    c.execute('DELETE FROM users WHERE id = ?', (user_id,))
+                c.execute(self._SQL_DELETE, (user_id,))
                 
                 conn.commit()
             
-            logger.info(f"✅ User deleted: {user_id}")
+            self._invalidate_user(user_id, user.username if user else None)
+            
+            logger.info("✅ User deleted: %s", user_id)
             return True
         
         except Exception as e:
-            logger.error(f"❌ Error deleting user: {e}", exc_info=True)
+            logger.error("❌ Error deleting user: %s", e, exc_info=True)
             raise
     
-    def get_all_users(self):
-        """すべてのユーザーを取得"""
+    def get_users_page(self, limit=100, after_id=None):
+        """ユーザーを ID 降順で1ページ分取得（キーセットページネーション）
+        
+        次のページは after_id に前ページ最後のユーザーの ID を渡して取得する
+        """
         try:
             with self.db_manager.get_db() as conn:
                 c = conn.cursor()
-                c.execute(f'SELECT {self._get_user_columns()} FROM users ORDER BY id DESC')
-                rows = c.fetchall()
-                
-                users = []
-                for row in rows:
-                    row_dict = row_to_dict(row)
-                    if row_dict:
-                        user = User(
-                            row_dict['id'],
-                            row_dict['username'],
-                            row_dict['password_hash']
-                        )
-                        users.append(user)
                 
-                return users
+                if after_id is None:
+                    c.execute(self._SQL_PAGE_FIRST, (limit,))
+                else:
+                    c.execute(self._SQL_PAGE_AFTER, (after_id, limit))
+                return [_row_to_user(row) for row in c.fetchall()]
         except Exception as e:
-            logger.error(f"❌ Error getting all users: {e}", exc_info=True)
+            logger.error("❌ Error getting users page: %s", e, exc_info=True)
             return []
+    
+    def iter_users(self, page_size=1000):
+        """全ユーザーをページ単位で順に返す（メモリ上には1ページ分のみ保持）"""
+        after_id = None
+        while True:
+            page = self.get_users_page(page_size, after_id)
+            yield from page
+            if len(page) < page_size:
+                return
+            after_id = page[-1].id
+    
+    def get_all_users(self):
+        """すべてのユーザーを取得"""
+        return list(self.iter_users())
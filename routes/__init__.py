@@ -1,14 +1,15 @@
-from .auth import auth_bp
-from .dashboard import dashboard_bp
-from .assets import assets_bp
-from .health import health_bp
-
 def register_blueprints(app):
     """全てのBlueprintを登録"""
+    # ルートモジュールは登録時に初めてインポートする（パッケージ import を軽くする）
+    from .auth import auth_bp
+    from .dashboard import dashboard_bp
+    from .assets import assets_bp
+    from .health import health_bp
+    
     # auth_bpを最初に登録（'/'ルートを処理）
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(dashboard_bp)
-    app.register_blueprint(assets_bp)
-    app.register_blueprint(health_bp)
+    app.register_blueprint(auth_bp, url_prefix='')
+    app.register_blueprint(dashboard_bp, url_prefix='')
+    app.register_blueprint(assets_bp, url_prefix='')
+    app.register_blueprint(health_bp, url_prefix='')
 
 __all__ = ['register_blueprints']
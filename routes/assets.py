@@ -1,37 +1,100 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, make_response
 from models import db_manager
-from services import price_service, asset_service
+from services import price_service, asset_service, scheduler_manager
 from utils import logger, constants
+from routes.auth import get_current_user
+from routes.dashboard import invalidate_dashboard
 import json
+import hashlib
+import os
 
 assets_bp = Blueprint('assets', __name__)
 
-def get_current_user():
-    """現在のユーザー情報を取得"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    
+# SQL は '?' で書き、モジュール読み込み時に接続先の方言へ変換しておく（リクエストごとに分岐しない）
+_SQL_LIST_ASSETS = db_manager.sql('''SELECT id, symbol, COALESCE(NULLIF(name, ''), symbol) AS name, quantity,
+                                            COALESCE(price, 0.0) AS price, COALESCE(avg_cost, 0.0) AS avg_cost
+                                     FROM assets
+                                     WHERE user_id = ? AND asset_type = ?
+                                     ORDER BY display_order ASC, symbol ASC''')
+_SQL_MAX_ORDER = db_manager.sql('SELECT MAX(display_order) AS max_order FROM assets WHERE user_id = ? AND asset_type = ?')
+_SQL_MAX_ORDER_BY_TYPE = db_manager.sql('SELECT asset_type, MAX(display_order) AS max_order FROM assets WHERE user_id = ? GROUP BY asset_type')
+_SQL_INSERT_ASSET = db_manager.sql('''INSERT INTO assets (user_id, asset_type, symbol, name, quantity, price, avg_cost, display_order)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)''')
+_SQL_INSERT_ASSET_RETURNING_ID = _SQL_INSERT_ASSET + ' RETURNING id'
+_SQL_GET_ASSET = db_manager.sql('SELECT * FROM assets WHERE id = ? AND user_id = ?')
+# 保険のみ銘柄・名称・価格も編集できる（それ以外は CASE で現在値のまま）
+# 負の数量は保険以外では更新しない（保険は従来どおり数量を検証しない）
+_SQL_UPDATE_ASSET = db_manager.sql('''UPDATE assets SET quantity = ?, avg_cost = ?,
+                                          symbol = CASE WHEN asset_type = 'insurance' THEN ? ELSE symbol END,
+                                          name = CASE WHEN asset_type = 'insurance' THEN ? ELSE name END,
+                                          price = CASE WHEN asset_type = 'insurance' THEN ? ELSE price END
+                                      WHERE id = ? AND user_id = ? AND (? >= 0 OR asset_type = 'insurance')
+                                      RETURNING id, asset_type, symbol, name, quantity, price, avg_cost''')
+_SQL_DELETE_ASSET = db_manager.sql('DELETE FROM assets WHERE id = ? AND user_id = ? RETURNING asset_type')
+
+# この秒数以内に価格更新済みの資産は再取得しない（連打対策）
+_PRICE_FRESH_SECONDS = 60
+if db_manager.use_postgres:
+    _STALE_COND = f"(last_price_update IS NULL OR last_price_update < CURRENT_TIMESTAMP - INTERVAL '{_PRICE_FRESH_SECONDS} seconds')"
+else:
+    _STALE_COND = f"(last_price_update IS NULL OR last_price_update < datetime('now', '-{_PRICE_FRESH_SECONDS} seconds'))"
+
+# 一括価格更新の対象タイプとクエリ
+# 対象の抽出は「古い行に取得中の印を付けて返す」1文で行い、重なった更新ジョブが同じ行を二重に取得しないようにする
+_PRICE_UPDATE_TYPES = ('jp_stock', 'us_stock', 'gold', 'crypto', 'investment_trust')
+_CLAIM_SQL = 'UPDATE assets SET last_price_update = CURRENT_TIMESTAMP WHERE user_id = ? AND {} AND ' + _STALE_COND + ' RETURNING id, asset_type, symbol'
+_SQL_CLAIM_ALL = db_manager.sql(_CLAIM_SQL.format('asset_type IN (' + ', '.join(['?'] * len(_PRICE_UPDATE_TYPES)) + ')'))
+_SQL_CLAIM_TYPE = db_manager.sql(_CLAIM_SQL.format('asset_type = ?'))
+# 価格を取得・保存できなかった行の印を外し、次の更新で再取得できるようにする
+_SQL_RELEASE_CLAIM = db_manager.sql('UPDATE assets SET last_price_update = NULL WHERE id = ? AND user_id = ?')
+
+# 一括追加1回あたりの上限（価格取得ジョブが共有の取得プールを長く占有しないように）
+_BULK_ADD_LIMIT = 100
+
+def _templates_version():
+    """テンプレートの最終更新時刻（デプロイでHTMLが変わったら ETag も変える）"""
+    templates_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
     try:
-        with db_manager.get_db() as conn:
-            c = conn.cursor()
-            
-            if db_manager.use_postgres:
-                c.execute('SELECT id, username FROM users WHERE id = %s', (user_id,))
-            else:
-                c.execute('SELECT id, username FROM users WHERE id = ?', (user_id,))
-            
-            user = c.fetchone()
-            
-            if user:
-                return {
-                    'id': int(user['id']),
-                    'username': str(user['username'])
-                }
-            return None
-    except Exception as e:
-        logger.error(f"❌ Error getting current user: {e}", exc_info=True)
-        return None
+        return str(max(os.path.getmtime(os.path.join(root, f))
+                       for root, _, files in os.walk(templates_dir) for f in files))
+    except ValueError:
+        return ''
+
+_ETAG_SALT = _templates_version()
+
+def _load_user_assets(user_id, asset_type):
+    """ユーザーの資産一覧と、その内容から作った ETag を取得
+    
+    複数ワーカーで動かすため一覧はプロセス内にキャッシュせず毎回 DB から読む
+    （別ワーカーでの更新後に古い一覧や古い ETag での 304 を返さないように）
+    """
+    with db_manager.get_db() as conn:
+        c = conn.cursor()
+        
+        # ソート順を display_order, symbol の順に変更
+        # NULL の補完は SQL 側で行い、dict で返る行をそのままテンプレートに渡す
+        # （数値列は DOUBLE PRECISION / REAL、NUMERIC も float 登録済みなので型変換は不要）
+        c.execute(_SQL_LIST_ASSETS, (user_id, asset_type))
+        assets_list = c.fetchall()
+    
+    etag = hashlib.sha1(json.dumps([_ETAG_SALT, user_id, assets_list], default=str).encode('utf-8')).hexdigest()
+    return assets_list, etag
+
+def _wants_json():
+    """JSON 応答を求めるリクエストか（fetch / XHR からの呼び出し）"""
+    return request.accept_mimetypes.best == 'application/json' or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+def _mutation_response(message, category, redirect_to, payload=None, status=200):
+    """更新系ルートの応答
+    
+    JSON クライアントには変更した行だけを返し（再読み込み不要）、フォーム送信はフラッシュしてリダイレクトする
+    """
+    if _wants_json():
+        if category == 'error':
+            return jsonify({'error': message}), status
+        return jsonify({**(payload or {}), 'message': message}), status
+    flash(message, category)
+    return redirect(redirect_to)
 
 @assets_bp.route('/assets/<asset_type>')
 def manage_assets(asset_type):
@@ -50,53 +113,32 @@ def manage_assets(asset_type):
         return redirect(url_for('dashboard.dashboard'))
     
     try:
-        with db_manager.get_db() as conn:
-            c = conn.cursor()
-            
-            # ソート順を display_order, symbol の順に変更
-            if db_manager.use_postgres:
-                c.execute('''SELECT id, symbol, name, quantity, price, avg_cost
-                            FROM assets 
-                            WHERE user_id = %s AND asset_type = %s
-                            ORDER BY display_order ASC, symbol ASC''', (user_id, asset_type))
-            else:
-                c.execute('''SELECT id, symbol, name, quantity, price, avg_cost
-                            FROM assets 
-                            WHERE user_id = ? AND asset_type = ?
-                            ORDER BY display_order ASC, symbol ASC''', (user_id, asset_type))
-            
-            assets = c.fetchall()
-            
-            assets_list = []
-            for asset in assets:
-                asset_dict = dict(asset) if hasattr(asset, 'keys') else {
-                    'id': asset[0], 'symbol': asset[1], 'name': asset[2],
-                    'quantity': asset[3], 'price': asset[4], 'avg_cost': asset[5]
-                }
-                
-                assets_list.append({
-                    'id': int(asset_dict['id']),
-                    'symbol': str(asset_dict['symbol']),
-                    'name': str(asset_dict['name']) if asset_dict['name'] else str(asset_dict['symbol']),
-                    'quantity': float(asset_dict['quantity']) if asset_dict['quantity'] is not None else 0.0,
-                    'price': float(asset_dict['price']) if asset_dict['price'] is not None else 0.0,
-                    'avg_cost': float(asset_dict['avg_cost']) if asset_dict['avg_cost'] is not None else 0.0
-                })
-            
-            logger.info(f"📊 Loaded {len(assets_list)} {asset_type} assets for user {user_name}")
-            
-            return render_template('manage_assets.html',
-                                 asset_type=asset_type,
-                                 info=info,
-                                 assets=assets_list,
-                                 user_name=user_name,
-                                 crypto_symbols=constants.CRYPTO_SYMBOLS,
-                                 precious_metal_symbols=constants.PRECIOUS_METAL_SYMBOLS, # 追加
-                                 investment_trust_symbols=constants.INVESTMENT_TRUST_SYMBOLS,
-                                 insurance_types=constants.INSURANCE_TYPES)
+        assets_list, etag = _load_user_assets(user_id, asset_type)
+        
+        # 内容が前回表示時と同じなら描画せず 304 を返す（未表示のフラッシュメッセージがある時は描画する）
+        if not session.get('_flashes') and request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        
+        logger.debug("📊 Loaded %d %s assets for user %s", len(assets_list), asset_type, user_name)
+        
+        response = make_response(render_template('manage_assets.html',
+                             asset_type=asset_type,
+                             info=info,
+                             assets=assets_list,
+                             user_name=user_name,
+                             crypto_symbols=constants.CRYPTO_SYMBOLS,
+                             precious_metal_symbols=constants.PRECIOUS_METAL_SYMBOLS, # 追加
+                             investment_trust_symbols=constants.INVESTMENT_TRUST_SYMBOLS,
+                             insurance_types=constants.INSURANCE_TYPES))
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     
     except Exception as e:
-        logger.error(f"❌ Error loading assets for {asset_type}: {e}", exc_info=True)
+        logger.error("❌ Error loading assets for %s: %s", asset_type, e, exc_info=True)
         flash('資産の読み込み中にエラーが発生しました', 'error')
         return redirect(url_for('dashboard.dashboard'))
 
@@ -115,29 +157,35 @@ def reorder_assets():
             return jsonify({'message': 'No changes'}), 200
             
         with db_manager.get_db() as conn:
-            c = conn.cursor()
-            for index, asset_id in enumerate(asset_ids):
-                if db_manager.use_postgres:
-                    c.execute('UPDATE assets SET display_order = %s WHERE id = %s AND user_id = %s', 
-                             (index, asset_id, user['id']))
-                else:
-                    c.execute('UPDATE assets SET display_order = ? WHERE id = ? AND user_id = ?', 
-                             (index, asset_id, user['id']))
+            # 行ごとの UPDATE（行ごとに解析・計画）を避け、1文/1バッチで反映
+            if db_manager.use_postgres:
+                from psycopg2.extras import execute_values
+                execute_values(
+                    db_manager.batch_cursor(conn),
+                    '''UPDATE assets AS a SET display_order = v.display_order
+                       FROM (VALUES %s) AS v(id, display_order, user_id)
+                       WHERE a.id = v.id AND a.user_id = v.user_id''',
+                    [(int(asset_id), index, user['id']) for index, asset_id in enumerate(asset_ids)],
+                    page_size=500
+                )
+            else:
+                conn.cursor().executemany('UPDATE assets SET display_order = ? WHERE id = ? AND user_id = ?',
+                                          [(index, asset_id, user['id']) for index, asset_id in enumerate(asset_ids)])
             conn.commit()
+            invalidate_dashboard(user['id'])
             
         return jsonify({'message': 'Order updated successfully'}), 200
         
     except Exception as e:
-        logger.error(f"❌ Error reordering assets: {e}", exc_info=True)
+        logger.error("❌ Error reordering assets: %s", e, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 @assets_bp.route('/add_asset', methods=['POST'])
 def add_asset():
-    """資産追加"""
+    """資産追加（JSON クライアントには追加した行を返す）"""
     user = get_current_user()
     if not user:
-        flash('ログインしてください', 'error')
-        return redirect(url_for('auth.login'))
+        return _mutation_response('ログインしてください', 'error', url_for('auth.login'), status=401)
     
     user_id = user['id']
     
@@ -145,96 +193,149 @@ def add_asset():
         asset_type = request.form.get('asset_type', '').strip()
         symbol = request.form.get('symbol', '').strip()
         quantity = float(request.form.get('quantity', 0))
+        redirect_to = url_for('assets.manage_assets', asset_type=asset_type)
         
         if not asset_type or not symbol or quantity < 0:
-            flash('入力内容を確認してください', 'error')
-            return redirect(url_for('assets.manage_assets', asset_type=asset_type))
+            return _mutation_response('入力内容を確認してください', 'error', redirect_to, status=400)
         
         # 新しいアイテムは最後尾に追加するため、現在の最大display_orderを取得
         with db_manager.get_db() as conn:
             c = conn.cursor()
-            if db_manager.use_postgres:
-                c.execute('SELECT MAX(display_order) FROM assets WHERE user_id = %s AND asset_type = %s', (user_id, asset_type))
-            else:
-                c.execute('SELECT MAX(display_order) FROM assets WHERE user_id = ? AND asset_type = ?', (user_id, asset_type))
-            max_order = c.fetchone()[0]
+            c.execute(_SQL_MAX_ORDER, (user_id, asset_type))
+            max_order = c.fetchone()['max_order']
             new_order = (max_order or 0) + 1
-
-        # 保険の場合
+        
         if asset_type == 'insurance':
+            # 保険の場合
             name = request.form.get('name', '').strip()
             avg_cost = float(request.form.get('avg_cost', 0))
             price = float(request.form.get('price', 0))
-            
-            with db_manager.get_db() as conn:
-                c = conn.cursor()
-                if db_manager.use_postgres:
-                    c.execute('''INSERT INTO assets (user_id, asset_type, symbol, name, quantity, price, avg_cost, display_order)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
-                             (user_id, asset_type, symbol, name, 0, price, avg_cost, new_order))
-                else:
-                    c.execute('''INSERT INTO assets (user_id, asset_type, symbol, name, quantity, price, avg_cost, display_order)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                             (user_id, asset_type, symbol, name, 0, price, avg_cost, new_order))
-                conn.commit()
-            
-            flash('保険を追加しました', 'success')
-            return redirect(url_for('assets.manage_assets', asset_type=asset_type))
-        
-        # 現金の場合
-        if asset_type == 'cash':
+            quantity = 0
+            message = '保険を追加しました'
+        elif asset_type == 'cash':
+            # 現金の場合
             avg_cost = 0.0
             price = 0.0
             name = symbol
-            
-            with db_manager.get_db() as conn:
-                c = conn.cursor()
-                if db_manager.use_postgres:
-                    c.execute('''INSERT INTO assets (user_id, asset_type, symbol, name, quantity, price, avg_cost, display_order)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
-                             (user_id, asset_type, symbol, name, quantity, price, avg_cost, new_order))
-                else:
-                    c.execute('''INSERT INTO assets (user_id, asset_type, symbol, name, quantity, price, avg_cost, display_order)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                             (user_id, asset_type, symbol, name, quantity, price, avg_cost, new_order))
-                conn.commit()
-            
-            flash('現金を追加しました', 'success')
-            return redirect(url_for('assets.manage_assets', asset_type=asset_type))
+            message = '現金を追加しました'
+        else:
+            # その他の資産（価格は外部APIを待たずに 0 で登録し、バックグラウンドで取得）
+            avg_cost = float(request.form.get('avg_cost', 0))
+            price = 0.0
+            name = symbol
+            message = '資産を追加しました'
         
-        # その他の資産
-        avg_cost = float(request.form.get('avg_cost', 0))
-        price = 0.0
-        name = symbol
+        with db_manager.get_db() as conn:
+            c = conn.cursor()
+            c.execute(_SQL_INSERT_ASSET_RETURNING_ID, (user_id, asset_type, symbol, name, quantity, price, avg_cost, new_order))
+            asset_id = c.fetchone()['id']
+            conn.commit()
+            invalidate_dashboard(user_id)
+        
+        if asset_type not in ('cash', 'insurance'):
+            try:
+                scheduler_manager.submit_user_job(f"asset_price_{asset_id}", user_id, _fetch_new_asset_prices,
+                                                  user_id, [(asset_id, asset_type, symbol)])
+            except Exception as e:
+                logger.warning("⚠️ Could not queue price fetch for %s: %s", symbol, e)
+        
+        return _mutation_response(message, 'success', redirect_to, status=201, payload={
+            'id': asset_id, 'asset_type': asset_type, 'symbol': symbol, 'name': name,
+            'quantity': quantity, 'price': price, 'avg_cost': avg_cost, 'display_order': new_order
+        })
+    
+    except Exception as e:
+        logger.error("❌ Error adding asset: %s", e, exc_info=True)
+        return _mutation_response('資産の追加に失敗しました', 'error',
+                                  url_for('assets.manage_assets', asset_type=request.form.get('asset_type', '').strip()),
+                                  status=500)
+
+@assets_bp.route('/add_assets_bulk', methods=['POST'])
+def add_assets_bulk():
+    """資産の一括追加（JSON）: 価格 0 で1回のINSERTにまとめ、価格はバックグラウンドで取得する"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_id = user['id']
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('assets', []) if isinstance(data, dict) else data
+        if len(items) > _BULK_ADD_LIMIT:
+            return jsonify({'error': f'Too many assets (max {_BULK_ADD_LIMIT})'}), 400
+        
+        rows = []
+        for item in items:
+            asset_type = str(item.get('asset_type', '')).strip()
+            symbol = str(item.get('symbol', '')).strip()
+            quantity = float(item.get('quantity', 0))
+            if asset_type not in constants.ASSET_TYPE_INFO or not symbol or quantity < 0:
+                return jsonify({'error': f'Invalid asset: {item}'}), 400
+            
+            if asset_type == 'insurance':
+                name = str(item.get('name', '')).strip()
+                price = float(item.get('price', 0))
+                avg_cost = float(item.get('avg_cost', 0))
+                quantity = 0
+            elif asset_type == 'cash':
+                name, price, avg_cost = symbol, 0.0, 0.0
+            else:
+                name, price, avg_cost = symbol, 0.0, float(item.get('avg_cost', 0))
+            rows.append((asset_type, symbol, name, quantity, price, avg_cost))
         
-        # 価格取得を試みる
-        try:
-            price_data = price_service.fetch_price({'id': 0, 'asset_type': asset_type, 'symbol': symbol})
-            if price_data and isinstance(price_data, dict):
-                price = float(price_data.get('price', 0.0))
-                name = str(price_data.get('name', symbol))
-        except Exception as e:
-            logger.warning(f"⚠️ Error fetching price for {symbol}: {e}")
+        if not rows:
+            return jsonify({'message': 'No assets'}), 200
         
         with db_manager.get_db() as conn:
             c = conn.cursor()
+            
+            # 資産タイプごとの現在の最大display_orderを1クエリで取得
+            c.execute(_SQL_MAX_ORDER_BY_TYPE, (user_id,))
+            next_order = {r['asset_type']: (r['max_order'] or 0) for r in c.fetchall()}
+            
+            insert_data = []
+            for asset_type, symbol, name, quantity, price, avg_cost in rows:
+                next_order[asset_type] = next_order.get(asset_type, 0) + 1
+                insert_data.append((user_id, asset_type, symbol, name, quantity,
+                                    price, avg_cost, next_order[asset_type]))
+            
             if db_manager.use_postgres:
-                c.execute('''INSERT INTO assets (user_id, asset_type, symbol, name, quantity, price, avg_cost, display_order)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
-                         (user_id, asset_type, symbol, name, quantity, price, avg_cost, new_order))
+                from psycopg2.extras import execute_values
+                new_ids = [r[0] for r in execute_values(
+                    db_manager.batch_cursor(conn),
+                    '''INSERT INTO assets (user_id, asset_type, symbol, name, quantity, price, avg_cost, display_order)
+                       VALUES %s RETURNING id''',
+                    insert_data,
+                    page_size=_BULK_ADD_LIMIT,
+                    fetch=True
+                )]
             else:
-                c.execute('''INSERT INTO assets (user_id, asset_type, symbol, name, quantity, price, avg_cost, display_order)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                         (user_id, asset_type, symbol, name, quantity, price, avg_cost, new_order))
+                new_ids = []
+                for params in insert_data:
+                    c.execute(_SQL_INSERT_ASSET_RETURNING_ID, params)
+                    new_ids.append(c.fetchone()['id'])
             conn.commit()
-        
-        flash('資産を追加しました', 'success')
-        return redirect(url_for('assets.manage_assets', asset_type=asset_type))
+            invalidate_dashboard(user_id)
+        
+        # 価格取得が必要なものはユーザー単位のジョブでまとめて取得（リクエストは外部APIを待たない）
+        to_fetch = [(asset_id, r[0], r[1]) for asset_id, r in zip(new_ids, rows)
+                    if r[0] not in ('cash', 'insurance')]
+        if to_fetch:
+            try:
+                scheduler_manager.submit_user_job(f"asset_price_bulk_{new_ids[0]}", user_id,
+                                                  _fetch_new_asset_prices, user_id, to_fetch)
+            except Exception as e:
+                logger.warning("⚠️ Could not queue price fetch for %d bulk assets: %s", len(to_fetch), e)
+        
+        logger.info("✅ Bulk added %d assets for user %s", len(insert_data), user_id)
+        return jsonify({'message': 'Assets added successfully', 'count': len(insert_data)}), 201
     
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({'error': f'Invalid request: {e}'}), 400
     except Exception as e:
-        logger.error(f"❌ Error adding asset: {e}", exc_info=True)
-        flash('資産の追加に失敗しました', 'error')
-        return redirect(url_for('assets.manage_assets', asset_type=asset_type))
+        logger.error("❌ Error bulk adding assets: %s", e, exc_info=True)
+        return jsonify({'error': str(e)}), 500
 
 @assets_bp.route('/edit_asset/<int:asset_id>')
 def edit_asset(asset_id):
@@ -249,10 +350,7 @@ def edit_asset(asset_id):
     try:
         with db_manager.get_db() as conn:
             c = conn.cursor()
-            if db_manager.use_postgres:
-                c.execute('SELECT * FROM assets WHERE id = %s AND user_id = %s', (asset_id, user_id))
-            else:
-                c.execute('SELECT * FROM assets WHERE id = ? AND user_id = ?', (asset_id, user_id))
+            c.execute(_SQL_GET_ASSET, (asset_id, user_id))
             
             asset = c.fetchone()
             
@@ -260,94 +358,62 @@ def edit_asset(asset_id):
                 flash('資産が見つかりません', 'error')
                 return redirect(url_for('dashboard.dashboard'))
             
-            asset_dict = dict(asset) if hasattr(asset, 'keys') else {}
-            info = constants.ASSET_TYPE_INFO.get(asset_dict['asset_type'])
+            info = constants.ASSET_TYPE_INFO.get(asset['asset_type'])
             
-            return render_template('edit_asset.html', asset=asset_dict, info=info, insurance_types=constants.INSURANCE_TYPES)
+            return render_template('edit_asset.html', asset=asset, info=info, insurance_types=constants.INSURANCE_TYPES)
     
     except Exception as e:
-        logger.error(f"❌ Error loading asset {asset_id}: {e}", exc_info=True)
+        logger.error("❌ Error loading asset %s: %s", asset_id, e, exc_info=True)
         flash('資産の読み込み中にエラーが発生しました', 'error')
         return redirect(url_for('dashboard.dashboard'))
 
 @assets_bp.route('/update_asset', methods=['POST'])
 def update_asset():
-    """資産更新"""
+    """資産更新（JSON クライアントには更新後の行を返す）"""
     user = get_current_user()
     if not user:
-        flash('ログインしてください', 'error')
-        return redirect(url_for('auth.login'))
+        return _mutation_response('ログインしてください', 'error', url_for('auth.login'), status=401)
     
     user_id = user['id']
     
     try:
         asset_id = int(request.form.get('asset_id'))
-        
-        with db_manager.get_db() as conn:
-            c = conn.cursor()
-            if db_manager.use_postgres:
-                c.execute('SELECT asset_type FROM assets WHERE id = %s AND user_id = %s', (asset_id, user_id))
-            else:
-                c.execute('SELECT asset_type FROM assets WHERE id = ? AND user_id = ?', (asset_id, user_id))
-            
-            asset = c.fetchone()
-            if not asset:
-                flash('資産が見つかりません', 'error')
-                return redirect(url_for('dashboard.dashboard'))
-            asset_type = asset['asset_type']
-        
-        if asset_type == 'insurance':
-            symbol = request.form.get('symbol', '').strip()
-            name = request.form.get('name', '').strip()
-            quantity = float(request.form.get('quantity', 0))
-            avg_cost = float(request.form.get('avg_cost', 0))
-            price = float(request.form.get('price', 0))
-            
-            with db_manager.get_db() as conn:
-                c = conn.cursor()
-                if db_manager.use_postgres:
-                    c.execute('''UPDATE assets SET symbol = %s, name = %s, quantity = %s, avg_cost = %s, price = %s
-                                WHERE id = %s AND user_id = %s''', (symbol, name, quantity, avg_cost, price, asset_id, user_id))
-                else:
-                    c.execute('''UPDATE assets SET symbol = ?, name = ?, quantity = ?, avg_cost = ?, price = ?
-                                WHERE id = ? AND user_id = ?''', (symbol, name, quantity, avg_cost, price, asset_id, user_id))
-                conn.commit()
-            
-            flash('保険を更新しました', 'success')
-            return redirect(url_for('assets.manage_assets', asset_type=asset_type))
-        
         quantity = float(request.form.get('quantity', 0))
         avg_cost = float(request.form.get('avg_cost', 0))
         
-        if quantity < 0:
-            flash('数量を正しく入力してください', 'error')
-            return redirect(url_for('assets.edit_asset', asset_id=asset_id))
+        # 保険のみ使う項目（_SQL_UPDATE_ASSET の CASE で保険以外は無視される）
+        symbol = request.form.get('symbol', '').strip()
+        name = request.form.get('name', '').strip()
+        price = float(request.form.get('price', 0))
         
         with db_manager.get_db() as conn:
             c = conn.cursor()
-            if db_manager.use_postgres:
-                c.execute('UPDATE assets SET quantity = %s, avg_cost = %s WHERE id = %s AND user_id = %s',
-                         (quantity, avg_cost, asset_id, user_id))
-            else:
-                c.execute('UPDATE assets SET quantity = ?, avg_cost = ? WHERE id = ? AND user_id = ?',
-                         (quantity, avg_cost, asset_id, user_id))
+            # 事前の SELECT なしで更新と更新後の行の取得を1文で行う
+            c.execute(_SQL_UPDATE_ASSET, (quantity, avg_cost, symbol, name, price, asset_id, user_id, quantity))
+            asset = c.fetchone()
             conn.commit()
+            
+            if not asset and quantity < 0:
+                return _mutation_response('数量を正しく入力してください', 'error',
+                                          url_for('assets.edit_asset', asset_id=asset_id), status=400)
+            if not asset:
+                return _mutation_response('資産が見つかりません', 'error', url_for('dashboard.dashboard'), status=404)
+            asset_type = asset['asset_type']
         
-        flash('資産を更新しました', 'success')
-        return redirect(url_for('assets.manage_assets', asset_type=asset_type))
+        invalidate_dashboard(user_id)
+        return _mutation_response('保険を更新しました' if asset_type == 'insurance' else '資産を更新しました', 'success',
+                                  url_for('assets.manage_assets', asset_type=asset_type), payload=dict(asset))
     
     except Exception as e:
-        logger.error(f"❌ Error updating asset: {e}", exc_info=True)
-        flash('資産の更新に失敗しました', 'error')
-        return redirect(url_for('dashboard.dashboard'))
+        logger.error("❌ Error updating asset: %s", e, exc_info=True)
+        return _mutation_response('資産の更新に失敗しました', 'error', url_for('dashboard.dashboard'), status=500)
 
 @assets_bp.route('/delete_asset', methods=['POST'])
 def delete_asset():
-    """資産削除"""
+    """資産削除（JSON クライアントには削除した ID を返す）"""
     user = get_current_user()
     if not user:
-        flash('ログインしてください', 'error')
-        return redirect(url_for('auth.login'))
+        return _mutation_response('ログインしてください', 'error', url_for('auth.login'), status=401)
     
     user_id = user['id']
     
@@ -356,158 +422,159 @@ def delete_asset():
         
         with db_manager.get_db() as conn:
             c = conn.cursor()
-            if db_manager.use_postgres:
-                c.execute('SELECT asset_type FROM assets WHERE id = %s AND user_id = %s', (asset_id, user_id))
-            else:
-                c.execute('SELECT asset_type FROM assets WHERE id = ? AND user_id = ?', (asset_id, user_id))
+            # 削除と資産タイプの取得を1文で行う（RETURNING は SQLite 3.35 以降）
+            c.execute(_SQL_DELETE_ASSET, (asset_id, user_id))
             asset = c.fetchone()
+            conn.commit()
             
             if not asset:
-                flash('資産が見つかりません', 'error')
-                return redirect(url_for('dashboard.dashboard'))
+                return _mutation_response('資産が見つかりません', 'error', url_for('dashboard.dashboard'), status=404)
             asset_type = asset['asset_type']
-            
-            if db_manager.use_postgres:
-                c.execute('DELETE FROM assets WHERE id = %s AND user_id = %s', (asset_id, user_id))
-            else:
-                c.execute('DELETE FROM assets WHERE id = ? AND user_id = ?', (asset_id, user_id))
-            conn.commit()
         
-        flash('資産を削除しました', 'success')
-        return redirect(url_for('assets.manage_assets', asset_type=asset_type))
+        invalidate_dashboard(user_id)
+        return _mutation_response('資産を削除しました', 'success', url_for('assets.manage_assets', asset_type=asset_type),
+                                  payload={'id': asset_id, 'asset_type': asset_type})
     
     except Exception as e:
-        logger.error(f"❌ Error deleting asset: {e}", exc_info=True)
-        flash('資産の削除に失敗しました', 'error')
-        return redirect(url_for('dashboard.dashboard'))
+        logger.error("❌ Error deleting asset: %s", e, exc_info=True)
+        return _mutation_response('資産の削除に失敗しました', 'error', url_for('dashboard.dashboard'), status=500)
 
-@assets_bp.route('/update_prices', methods=['POST'])
-def update_prices():
-    """特定資産タイプの価格を更新 + スナップショット保存"""
-    user = get_current_user()
-    if not user:
-        flash('ログインしてください', 'error')
-        return redirect(url_for('auth.login'))
+def _fetch_new_asset_prices(user_id, assets):
+    """追加直後の資産 [(id, asset_type, symbol), ...] の価格・名称を取得して反映（バックグラウンドジョブ本体）"""
+    updated_prices = price_service.fetch_prices_parallel(assets)
+    if not updated_prices:
+        logger.warning("⚠️ No price fetched for %d new assets", len(assets))
+        return 0
     
-    user_id = user['id']
-    asset_type = request.form.get('asset_type')
+    with db_manager.get_db() as conn:
+        asset_service.save_prices(conn, user_id, updated_prices)
+        conn.commit()
+    invalidate_dashboard(user_id)
+    return len(updated_prices)
+
+def _release_unpriced_claims(user_id, claimed_assets, saved_prices):
+    """取得中の印を付けたが価格を保存できなかった資産の印を外す"""
+    saved_ids = {int(p['id']) for p in saved_prices}
+    release = [(a['id'], user_id) for a in claimed_assets if a['id'] not in saved_ids]
+    if not release:
+        return
     
     try:
         with db_manager.get_db() as conn:
-            c = conn.cursor()
-            if db_manager.use_postgres:
-                c.execute('SELECT id, asset_type, symbol FROM assets WHERE user_id = %s AND asset_type = %s', 
-                         (user_id, asset_type))
-            else:
-                c.execute('SELECT id, asset_type, symbol FROM assets WHERE user_id = ? AND asset_type = ?', 
-                         (user_id, asset_type))
-            assets = c.fetchall()
-        
-        if not assets:
-            flash('更新する資産がありません', 'warning')
-            return redirect(url_for('assets.manage_assets', asset_type=asset_type))
-        
-        assets_list = [{'id': int(a['id']), 'asset_type': str(a['asset_type']), 'symbol': str(a['symbol'])} for a in assets]
-        
-        updated_prices = price_service.fetch_prices_parallel(assets_list)
+            conn.cursor().executemany(_SQL_RELEASE_CLAIM, release)
+            conn.commit()
+        logger.info("↩️ Released %d assets without a fetched price for retry", len(release))
+    except Exception as e:
+        logger.error("❌ Failed to release price claims: %s", e, exc_info=True)
+
+def _refresh_prices(user_id, asset_type=None):
+    """価格を取得してDBに反映し、スナップショットを保存（バックグラウンドジョブ本体）
+    
+    asset_type を省略すると価格取得対象の全タイプを更新する。更新件数を返す
+    """
+    with db_manager.get_db() as conn:
+        c = conn.cursor()
+        # 直近に更新済み・他のジョブが取得中の資産は除外（全件新しければ外部APIを1回も呼ばない）
+        if asset_type:
+            c.execute(_SQL_CLAIM_TYPE, (user_id, asset_type))
+        else:
+            c.execute(_SQL_CLAIM_ALL, (user_id, *_PRICE_UPDATE_TYPES))
+        assets = c.fetchall()
+        conn.commit()
+    
+    if not assets:
+        logger.info("ℹ️ No stale assets to update for user %s (%s)", user_id, asset_type or 'all')
+        return 0
+    
+    logger.info("🔄 Starting price update for %d assets", len(assets))
+    saved_prices = []
+    try:
+        updated_prices = price_service.fetch_prices_parallel(assets)
         
         if not updated_prices:
-            flash('価格の取得に失敗しました', 'error')
-            return redirect(url_for('assets.manage_assets', asset_type=asset_type))
+            logger.warning("⚠️ No prices fetched for user %s (%s)", user_id, asset_type or 'all')
+            return 0
         
         with db_manager.get_db() as conn:
-            c = conn.cursor()
-            for price_data in updated_prices:
-                asset_id = int(price_data['id'])
-                new_price = float(price_data['price'])
-                new_name = str(price_data.get('name', ''))
-                
-                if db_manager.use_postgres:
-                    c.execute('UPDATE assets SET price = %s, name = %s WHERE id = %s', (new_price, new_name, asset_id))
-                else:
-                    c.execute('UPDATE assets SET price = ?, name = ? WHERE id = ?', (new_price, new_name, asset_id))
+            asset_service.save_prices(conn, user_id, updated_prices)
             conn.commit()
-        
-        # Snapshot recording with enhanced logging
-        try:
-            logger.info(f"📸 Triggering snapshot after price update for {asset_type} (User: {user_id})")
-            asset_service.record_asset_snapshot(user_id)
-            logger.info(f"✅ Snapshot recording requested successfully")
-            flash(f'{len(updated_prices)}件の価格を更新し、最新データを保存しました', 'success')
-        except Exception as snapshot_error:
-            logger.error(f"❌ Snapshot recording failed: {snapshot_error}", exc_info=True)
-            flash(f'{len(updated_prices)}件の価格を更新しました（スナップショット保存に失敗: {snapshot_error}）', 'success')
-        
-        return redirect(url_for('assets.manage_assets', asset_type=asset_type))
+        saved_prices = updated_prices
+    finally:
+        _release_unpriced_claims(user_id, assets, saved_prices)
+    invalidate_dashboard(user_id)
     
+    logger.info("✅ Updated %d prices for user %s (%s)", len(updated_prices), user_id, asset_type or 'all')
+    
+    # Snapshot recording with enhanced logging
+    try:
+        logger.info("📸 Triggering snapshot after price update (User: %s)", user_id)
+        asset_service.record_asset_snapshot(user_id)
+        # 前日比・履歴グラフが変わるので、スナップショット保存後にもう一度破棄する
+        invalidate_dashboard(user_id)
+        logger.info("✅ Snapshot recording requested successfully")
+    except Exception as snapshot_error:
+        logger.error("❌ Snapshot recording failed: %s", snapshot_error, exc_info=True)
+    
+    return len(updated_prices)
+
+def _start_price_update(user_id, asset_type, redirect_to):
+    """価格更新をバックグラウンドジョブとして開始
+    
+    JSON を要求するクライアントには 202 とジョブIDを返し、フォーム送信はリダイレクトする
+    """
+    job_id = scheduler_manager.submit_user_job(
+        f"price_update_{user_id}_{asset_type or 'all'}", user_id, _refresh_prices, user_id, asset_type
+    )
+    
+    if _wants_json():
+        status_url = url_for('assets.price_job_status', job_id=job_id)
+        return jsonify({'job_id': job_id, 'status_url': status_url}), 202, {'Location': status_url}
+    
+    flash('価格の更新を開始しました。しばらくしてから再読み込みしてください', 'info')
+    return redirect(redirect_to)
+
+@assets_bp.route('/update_prices', methods=['POST'])
+def update_prices():
+    """特定資産タイプの価格を更新 + スナップショット保存（バックグラウンド実行）"""
+    user = get_current_user()
+    if not user:
+        flash('ログインしてください', 'error')
+        return redirect(url_for('auth.login'))
+    
+    asset_type = request.form.get('asset_type')
+    redirect_to = url_for('assets.manage_assets', asset_type=asset_type)
+    
+    try:
+        return _start_price_update(user['id'], asset_type, redirect_to)
     except Exception as e:
-        logger.error(f"❌ Error updating prices: {e}", exc_info=True)
+        logger.error("❌ Error updating prices: %s", e, exc_info=True)
         flash('価格の更新に失敗しました', 'error')
-        return redirect(url_for('assets.manage_assets', asset_type=asset_type))
+        return redirect(redirect_to)
 
 @assets_bp.route('/update_all_prices', methods=['POST'])
 def update_all_prices():
-    """全資産の価格を更新 + スナップショット保存"""
+    """全資産の価格を更新 + スナップショット保存（バックグラウンド実行）"""
     user = get_current_user()
     if not user:
         flash('ログインしてください', 'error')
         return redirect(url_for('auth.login'))
     
-    user_id = user['id']
-    
     try:
-        with db_manager.get_db() as conn:
-            c = conn.cursor()
-            asset_types_to_update = ['jp_stock', 'us_stock', 'gold', 'crypto', 'investment_trust']
-            ph = ', '.join(['%s'] * len(asset_types_to_update)) if db_manager.use_postgres else ', '.join(['?'] * len(asset_types_to_update))
-            
-            query = f'SELECT id, asset_type, symbol FROM assets WHERE user_id = {("%s" if db_manager.use_postgres else "?")} AND asset_type IN ({ph})'
-            params = [user_id] + asset_types_to_update
-            
-            c.execute(query, params)
-            assets = c.fetchall()
-        
-        if not assets:
-            flash('更新する資産がありません', 'warning')
-            return redirect(url_for('dashboard.dashboard'))
-        
-        assets_list = [{'id': int(a['id']), 'asset_type': str(a['asset_type']), 'symbol': str(a['symbol'])} for a in assets]
-        
-        logger.info(f"🔄 Starting price update for {len(assets_list)} assets")
-        updated_prices = price_service.fetch_prices_parallel(assets_list)
-        
-        if not updated_prices:
-            flash('価格の取得に失敗しました', 'error')
-            return redirect(url_for('dashboard.dashboard'))
-        
-        with db_manager.get_db() as conn:
-            c = conn.cursor()
-            for price_data in updated_prices:
-                asset_id = int(price_data['id'])
-                new_price = float(price_data['price'])
-                new_name = str(price_data.get('name', ''))
-                
-                if db_manager.use_postgres:
-                    c.execute('UPDATE assets SET price = %s, name = %s WHERE id = %s', (new_price, new_name, asset_id))
-                else:
-                    c.execute('UPDATE assets SET price = ?, name = ? WHERE id = ?', (new_price, new_name, asset_id))
-            conn.commit()
-        
-        logger.info(f"✅ Updated all prices ({len(updated_prices)} assets) for user {user_id}")
-        
-        # Snapshot recording with enhanced logging
-        try:
-            logger.info(f"📸 Triggering snapshot after ALL price update (User: {user_id})")
-            asset_service.record_asset_snapshot(user_id)
-            logger.info(f"✅ Snapshot recording requested successfully")
-            flash(f'{len(updated_prices)}件の価格を更新し、最新データを保存しました', 'success')
-        except Exception as snapshot_error:
-            logger.error(f"❌ Snapshot recording failed: {snapshot_error}", exc_info=True)
-            flash(f'{len(updated_prices)}件の価格を更新しました（スナップショット保存に失敗: {snapshot_error}）', 'success')
-        
-        return redirect(url_for('dashboard.dashboard'))
-    
+        return _start_price_update(user['id'], None, url_for('dashboard.dashboard'))
     except Exception as e:
-        logger.error(f"❌ Error updating all prices: {e}", exc_info=True)
+        logger.error("❌ Error updating all prices: %s", e, exc_info=True)
         flash('価格の更新に失敗しました', 'error')
-        return redirect(url_for('dashboard.dashboard'))
\ No newline at end of file
+        return redirect(url_for('dashboard.dashboard'))
+
+@assets_bp.route('/price_job_status/<job_id>')
+def price_job_status(job_id):
+    """価格更新ジョブの状態を返す"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    job = scheduler_manager.get_user_job(job_id)
+    if not job or job['user_id'] != user['id']:
+        return jsonify({'error': 'Not found'}), 404
+    
+    return jsonify({'job_id': job_id, 'status': job['status'], 'updated': job['result'], 'error': job['error']}), 200
@@ -1,19 +1,61 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, g
 from models import db_manager
-from utils import logger
+from utils import logger, hash_password, verify_password
 
 auth_bp = Blueprint('auth', __name__)
 
+# SQL は '?' で書き、モジュール読み込み時に接続先の方言へ変換しておく
+_SQL_GET_USER_BY_ID = db_manager.sql('SELECT id, username FROM users WHERE id = ?')
+_SQL_GET_USER_FOR_LOGIN = db_manager.sql('SELECT id, username, password_hash FROM users WHERE username = ?')
+_SQL_USERNAME_EXISTS = db_manager.sql('SELECT id FROM users WHERE username = ?')
+_SQL_INSERT_USER = db_manager.sql('INSERT INTO users (username, password_hash) VALUES (?, ?)')
+
+def get_current_user():
+    """現在のユーザー情報を取得（同一リクエスト内では g にキャッシュ）"""
+    if 'current_user' in g:
+        return g.current_user
+    g.current_user = _load_current_user()
+    return g.current_user
+
+def _load_current_user():
+    """セッションからユーザー情報を取得（署名付きセッションに username があればDBを引かない）"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+    
+    username = session.get('username')
+    if username:
+        return {'id': int(user_id), 'username': str(username)}
+    
+    # 古いセッション（username 未保存）のみDBで補完し、以降はセッションから読めるよう書き戻す
+    try:
+        with db_manager.get_db() as conn:
+            c = conn.cursor()
+            
+            c.execute(_SQL_GET_USER_BY_ID, (user_id,))
+            
+            user = c.fetchone()
+            
+            if user:
+                session['username'] = str(user['username'])
+                return {
+                    'id': int(user['id']),
+                    'username': str(user['username'])
+                }
+            return None
+    except Exception as e:
+        logger.error("❌ Error getting current user: %s", e, exc_info=True)
+        return None
+
 @auth_bp.route('/')
 def index():
     """ルートページ"""
     # ✅ ログイン済みならダッシュボードへ、未ログインならログインページへ
     if 'user_id' in session:
-        logger.info(f"✅ User {session.get('username')} already logged in, redirecting to dashboard")
+        logger.debug("✅ User %s already logged in, redirecting to dashboard", session.get('username'))
         return redirect(url_for('dashboard.dashboard'))
     
-    logger.info("👤 Anonymous user accessing root, redirecting to login")
+    logger.debug("👤 Anonymous user accessing root, redirecting to login")
     return redirect(url_for('auth.login'))
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
@@ -21,31 +63,28 @@ def login():
     """ログインページ"""
     # ✅ 既にログイン済みの場合はダッシュボードへリダイレクト
     if 'user_id' in session:
-        logger.info(f"✅ User {session.get('username')} already logged in")
+        logger.debug("✅ User %s already logged in", session.get('username'))
         return redirect(url_for('dashboard.dashboard'))
     
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '')
         
-        logger.info(f"🔐 Login attempt for user: {username}")
+        logger.info("🔐 Login attempt for user: %s", username)
         
         # 入力検証
         if not username or not password:
-            logger.warning(f"❌ Empty username or password")
+            logger.warning("❌ Empty username or password")
             flash('ユーザー名とパスワードを入力してください', 'error')
             return render_template('login.html')
         
         try:
             with db_manager.get_db() as conn:
                 c = conn.cursor()
-                logger.info(f"🔌 Using {'PostgreSQL' if db_manager.use_postgres else 'SQLite'} for login")
+                logger.debug("🔌 Using %s for login", 'PostgreSQL' if db_manager.use_postgres else 'SQLite')
                 
                 # ユーザー検索
-                if db_manager.use_postgres:
-                    c.execute('SELECT id, username, password_hash FROM users WHERE username = %s', (username,))
-                else:
-                    c.execute('SELECT id, username, password_hash FROM users WHERE username = ?', (username,))
+                c.execute(_SQL_GET_USER_FOR_LOGIN, (username,))
                 
                 user = c.fetchone()
                 
@@ -54,33 +93,33 @@ def login():
                     user_username = user['username']
                     user_password_hash = user['password_hash']
                     
-                    logger.info(f"✅ User found: {user_username} (ID: {user_id})")
+                    logger.debug("✅ User found: %s (ID: %s)", user_username, user_id)
                     
                     # パスワード検証
-                    if check_password_hash(user_password_hash, password):
-                        logger.info(f"✅ Password verified for user: {user_username}")
+                    if verify_password(user_password_hash, password):
+                        logger.debug("✅ Password verified for user: %s", user_username)
                         session.clear()  # ✅ 既存のセッションをクリア
                         session['user_id'] = user_id
                         session['username'] = user_username
                         session.permanent = True  # ✅ セッションを永続化
-                        logger.info(f"✅ Session created for user: {user_username}")
+                        logger.info("✅ Session created for user: %s", user_username)
                         flash(f'{user_username}さん、ようこそ！', 'success')
                         return redirect(url_for('dashboard.dashboard'))
                     else:
-                        logger.warning(f"❌ Invalid password for user: {user_username}")
+                        logger.warning("❌ Invalid password for user: %s", user_username)
                         flash('ユーザー名またはパスワードが間違っています', 'error')
                 else:
-                    logger.warning(f"❌ User not found: {username}")
+                    logger.warning("❌ User not found: %s", username)
                     flash('ユーザー名またはパスワードが間違っています', 'error')
         
         except Exception as e:
-            logger.error(f"❌ Login error: {e}", exc_info=True)
+            logger.error("❌ Login error: %s", e, exc_info=True)
             flash('ログイン処理中にエラーが発生しました', 'error')
         
         return render_template('login.html')
     
     # GET リクエスト
-    logger.info("📄 Rendering login page")
+    logger.debug("📄 Rendering login page")
     return render_template('login.html')
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
@@ -95,7 +134,7 @@ def register():
         password = request.form.get('password', '')
         password_confirm = request.form.get('confirm_password', '')
         
-        logger.info(f"📝 Registration attempt for user: {username}")
+        logger.info("📝 Registration attempt for user: %s", username)
         
         # 入力検証
         if not username or not password or not password_confirm:
@@ -119,35 +158,26 @@ def register():
                 c = conn.cursor()
                 
                 # ユーザー名の重複チェック
-                if db_manager.use_postgres:
-                    c.execute('SELECT id FROM users WHERE username = %s', (username,))
-                else:
-                    c.execute('SELECT id FROM users WHERE username = ?', (username,))
+                c.execute(_SQL_USERNAME_EXISTS, (username,))
                 
                 if c.fetchone():
-                    logger.warning(f"❌ Username already exists: {username}")
+                    logger.warning("❌ Username already exists: %s", username)
                     flash('このユーザー名は既に使用されています', 'error')
                     return render_template('register.html')
                 
                 # パスワードをハッシュ化
-                password_hash = generate_password_hash(password)
-                logger.info(f"🔐 Generated hash preview: {password_hash[:50]}...")
+                password_hash = hash_password(password)
                 
                 # ユーザー登録
-                if db_manager.use_postgres:
-                    c.execute('INSERT INTO users (username, password_hash) VALUES (%s, %s)',
-                             (username, password_hash))
-                else:
-                    c.execute('INSERT INTO users (username, password_hash) VALUES (?, ?)',
-                             (username, password_hash))
+                c.execute(_SQL_INSERT_USER, (username, password_hash))
                 
                 conn.commit()
-                logger.info(f"✅ User registered successfully: {username}")
+                logger.info("✅ User registered successfully: %s", username)
                 flash('ユーザー登録が完了しました。ログインしてください。', 'success')
                 return redirect(url_for('auth.login'))
         
         except Exception as e:
-            logger.error(f"❌ Registration error: {e}", exc_info=True)
+            logger.error("❌ Registration error: %s", e, exc_info=True)
             flash('登録処理中にエラーが発生しました', 'error')
         
         return render_template('register.html')
@@ -160,6 +190,6 @@ def logout():
     """ログアウト"""
     username = session.get('username', 'Unknown')
     session.clear()
-    logger.info(f"👋 User logged out: {username}")
+    logger.info("👋 User logged out: %s", username)
     flash('ログアウトしました', 'info')
     return redirect(url_for('auth.login'))
@@ -1,101 +1,136 @@
-from flask import Blueprint, render_template, session, redirect, url_for, flash
+from flask import Blueprint, render_template, session, redirect, url_for, flash, current_app, jsonify
+from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from models import db_manager
-from utils import logger
-import json
+from utils import logger, json_dumps
+from utils.cache import SimpleCache
+from routes.auth import get_current_user
+from services import asset_service
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
+# SQL は '?' で書き、モジュール読み込み時に接続先の方言へ変換しておく
+# 資産タイプごとの評価額・取得額を DB 側で1回の GROUP BY で集計する（? の1・2番目は USD/JPY レート）
+_SQL_ASSET_AGGREGATES = db_manager.sql('''SELECT asset_type,
+                                                 SUM(CASE asset_type
+                                                         WHEN 'us_stock' THEN COALESCE(quantity, 0) * COALESCE(price, 0) * ?
+                                                         WHEN 'investment_trust' THEN COALESCE(quantity, 0) * COALESCE(price, 0) / 10000
+                                                         WHEN 'insurance' THEN COALESCE(price, 0)
+                                                         WHEN 'cash' THEN COALESCE(quantity, 0)
+                                                         ELSE COALESCE(quantity, 0) * COALESCE(price, 0)
+                                                     END) AS total,
+                                                 SUM(CASE asset_type
+                                                         WHEN 'us_stock' THEN COALESCE(quantity, 0) * COALESCE(avg_cost, 0) * ?
+                                                         WHEN 'investment_trust' THEN COALESCE(quantity, 0) * COALESCE(avg_cost, 0) / 10000
+                                                         WHEN 'insurance' THEN COALESCE(avg_cost, 0)
+                                                         WHEN 'cash' THEN 0
+                                                         ELSE COALESCE(quantity, 0) * COALESCE(avg_cost, 0)
+                                                     END) AS cost
+                                          FROM assets
+                                          WHERE user_id = ?
+                                          GROUP BY asset_type''')
+_SQL_HISTORY = db_manager.sql('''SELECT record_date, jp_stock_value, us_stock_value, cash_value,
+                                        gold_value, crypto_value, investment_trust_value,
+                                        insurance_value, total_value
+                                 FROM asset_history
+                                 WHERE user_id = ?
+                                 ORDER BY record_date DESC
+                                 LIMIT 365''')
+
+# タイプ別の統計値をテンプレートへ渡すときの変数名（接頭辞_項目名）
+_STAT_PREFIXES = ('jp', 'us', 'cash', 'gold', 'crypto', 'investment_trust', 'insurance')
+_STAT_FIELDS = ('total', 'profit', 'profit_rate', 'day_change', 'day_change_rate')
+# 集計できなかったときに 0 で埋めるテンプレート変数（米国株は円換算・ドル建ての名前でも渡す）
+_DASHBOARD_NUMBER_KEYS = (
+    ('total_assets', 'total_profit', 'total_profit_rate', 'total_day_change', 'total_day_change_rate',
+     'us_total_jpy', 'us_total_usd', 'us_profit_jpy')
+    + tuple(f'{prefix}_{field}' for prefix in _STAT_PREFIXES for field in _STAT_FIELDS)
+)
+
+@dataclass(slots=True)
+class AssetStats:
+    """資産タイプ別の集計値"""
+    total: float = 0.0
+    cost: float = 0.0
+    profit: float = 0.0
+    profit_rate: float = 0.0
+    day_change: float = 0.0
+    day_change_rate: float = 0.0
+
 def safe_get(obj, key, default=0.0):
-    """辞書またはRow オブジェクトから安全に値を取得"""
-    try:
-        if obj is None:
-            return default
-        if hasattr(obj, '__getitem__'):
-            val = obj[key]
-            return float(val) if val is not None else default
-        return default
-    except (KeyError, IndexError, TypeError, ValueError) as e:
-        logger.debug(f"safe_get error for key '{key}': {e}")
+    """行（両DBとも dict）から数値を取得（行がない・列がない・NULL のときは default）"""
+    if obj is None:
         return default
+    val = obj.get(key)
+    return default if val is None else float(val)
+
+# ダッシュボード用データのキャッシュ（(user_id, JSTの日付) 単位、資産の更新系ルートで破棄）
+# 値は (users.data_version, データ)。キャッシュはワーカーごとだが、版数は DB で共有するので
+# 別のワーカーで資産が更新されても次の表示で作り直される
+_dashboard_cache = SimpleCache(duration=60, maxsize=1024)
+
+def _today_jst():
+    return datetime.now(timezone(timedelta(hours=9))).date()
+
+def invalidate_dashboard(user_id):
+    """ダッシュボードのキャッシュを破棄（資産の追加・更新・削除・価格更新時）
+    
+    DB の版数を上げるので、他のワーカーのキャッシュも次の表示で無効になる
+    """
+    _dashboard_cache.delete((user_id, _today_jst()))
+    try:
+        asset_service.bump_data_version(user_id)
+    except Exception as e:
+        logger.error("❌ Failed to bump data version for user %s: %s", user_id, e, exc_info=True)
 
 def get_dashboard_data(user_id):
-    """ダッシュボード用データを取得"""
+    """ダッシュボード用データを取得（60秒キャッシュ）
+    
+    呼び出し側が値を書き足しても汚れないよう、キャッシュの浅いコピーを返す
+    """
+    cache_key = (user_id, _today_jst())
+    # 版数は集計より先に読む（集計中に更新されても、保存した版数が古いので次回作り直される）
+    version = asset_service.get_data_version(user_id)
+    cached = _dashboard_cache.get(cache_key)
+    if cached is not None and cached[0] == version:
+        return dict(cached[1])
+    
+    data = _build_dashboard_data(user_id)
+    if data is not None:
+        _dashboard_cache.set(cache_key, (version, data))
+        return dict(data)
+    return None
+
+def _build_dashboard_data(user_id):
+    """ダッシュボード用データを集計"""
     try:
-        logger.info(f"📊 === Starting get_dashboard_data for user_id={user_id} ===")
+        logger.debug("📊 === Starting get_dashboard_data for user_id=%s ===", user_id)
+        
+        # USD/JPY レート取得（外部APIを待つ間はDB接続を借りない）
+        try:
+            from services.price_service import price_service
+            usd_jpy = price_service.get_usd_jpy_rate()
+        except Exception as e:
+            usd_jpy = 150.0
         
         with db_manager.get_db() as conn:
             c = conn.cursor()
             
-            # 全資産を取得（✅ display_order順でソート）
-            # asset_typeでグループ化しつつ、その中でdisplay_order順に並べる
-            if db_manager.use_postgres:
-                c.execute('SELECT * FROM assets WHERE user_id = %s ORDER BY asset_type, display_order ASC, symbol ASC', (user_id,))
-            else:
-                c.execute('SELECT * FROM assets WHERE user_id = ? ORDER BY asset_type, display_order ASC, symbol ASC', (user_id,))
-            
-            all_assets = c.fetchall()
-            
-            assets_by_type = {
-                'jp_stock': [], 'us_stock': [], 'cash': [], 'gold': [], 
-                'crypto': [], 'investment_trust': [], 'insurance': []
-            }
-            
-            if all_assets:
-                for asset in all_assets:
-                    try:
-                        asset_type = asset['asset_type']
-                        if asset_type in assets_by_type:
-                            assets_by_type[asset_type].append(dict(asset))
-                    except (KeyError, TypeError) as e:
-                        continue
-            
             # 昨日の日付（JST）
             jst = timezone(timedelta(hours=9))
             today = datetime.now(jst).date()
             yesterday = today - timedelta(days=1)
             
-            # 昨日のスナップショット取得
-            query_snapshot = '''SELECT record_date, jp_stock_value, us_stock_value, cash_value, 
-                                   gold_value, crypto_value, investment_trust_value, 
-                                   insurance_value, total_value
-                            FROM asset_history 
-                            WHERE user_id = %s AND record_date = %s''' if db_manager.use_postgres else '''SELECT record_date, jp_stock_value, us_stock_value, cash_value, 
-                                   gold_value, crypto_value, investment_trust_value, 
-                                   insurance_value, total_value
-                            FROM asset_history 
-                            WHERE user_id = ? AND record_date = ?'''
-            
-            c.execute(query_snapshot, (user_id, yesterday))
-            yesterday_snapshot = c.fetchone()
-            
-            # USD/JPY レート取得
-            try:
-                from services.price_service import price_service
-                usd_jpy = price_service.get_usd_jpy_rate()
-            except Exception as e:
-                usd_jpy = 150.0
+            # 履歴データ取得（最新365日分を降順で取得）
+            # 昨日のスナップショットも先頭付近に含まれるので、別クエリにせずここから取り出す
+            c.execute(_SQL_HISTORY, (user_id,))
+            history = c.fetchall() or []
+            yesterday_key = yesterday.isoformat()
+            yesterday_snapshot = next((h for h in history[:2] if str(h['record_date'])[:10] == yesterday_key), None)
             
-            def calculate_current_value(assets, asset_type):
-                total = 0.0
-                for asset in assets:
-                    try:
-                        quantity = float(asset.get('quantity', 0))
-                        price = float(asset.get('price', 0))
-                        
-                        if asset_type == 'us_stock':
-                            total += quantity * price * usd_jpy
-                        elif asset_type == 'investment_trust':
-                            total += (quantity * price) / 10000
-                        elif asset_type == 'insurance':
-                            total += price
-                        elif asset_type == 'cash':
-                            total += quantity
-                        else:
-                            total += quantity * price
-                    except Exception:
-                        continue
-                return total
+            # 評価額・取得額はタイプごとに SQL で集計する（ダッシュボードは明細を表示しないので行は取得しない）
+            c.execute(_SQL_ASSET_AGGREGATES, (usd_jpy, usd_jpy, user_id))
+            aggregates = {row['asset_type']: row for row in c.fetchall()}
             
             def calculate_day_change(current_value, asset_type):
                 if not yesterday_snapshot:
@@ -114,56 +149,39 @@ def get_dashboard_data(user_id):
                 day_change_rate = (day_change / yesterday_value * 100) if yesterday_value > 0 else 0.0
                 return day_change, day_change_rate
             
-            def get_asset_totals(assets, asset_type):
-                if not assets:
-                    return {'total': 0.0, 'cost': 0.0, 'profit': 0.0, 'profit_rate': 0.0, 'day_change': 0.0, 'day_change_rate': 0.0}
+            def get_asset_totals(asset_type):
+                aggregate = aggregates.get(asset_type)
+                if not aggregate:
+                    return AssetStats()
                 
-                total_value = calculate_current_value(assets, asset_type)
-                cost_value = 0.0
-                
-                for asset in assets:
-                    quantity = float(asset.get('quantity', 0))
-                    avg_cost = float(asset.get('avg_cost', 0))
-                    
-                    if asset_type == 'us_stock':
-                        cost_value += quantity * avg_cost * usd_jpy
-                    elif asset_type == 'investment_trust':
-                        cost_value += (quantity * avg_cost) / 10000
-                    elif asset_type == 'insurance':
-                        cost_value += avg_cost
-                    elif asset_type == 'cash':
-                        cost_value += 0
-                    else:
-                        cost_value += quantity * avg_cost
+                total_value = safe_get(aggregate, 'total')
+                cost_value = safe_get(aggregate, 'cost')
                 
                 profit = total_value - cost_value
                 profit_rate = (profit / cost_value * 100) if cost_value > 0 else 0.0
                 day_change, day_change_rate = calculate_day_change(total_value, asset_type)
                 
-                return {
-                    'total': total_value, 'cost': cost_value, 'profit': profit, 'profit_rate': profit_rate,
-                    'day_change': day_change, 'day_change_rate': day_change_rate
-                }
+                return AssetStats(total_value, cost_value, profit, profit_rate, day_change, day_change_rate)
             
-            jp_stats = get_asset_totals(assets_by_type['jp_stock'], 'jp_stock')
-            us_stats = get_asset_totals(assets_by_type['us_stock'], 'us_stock')
-            cash_stats = get_asset_totals(assets_by_type['cash'], 'cash')
-            gold_stats = get_asset_totals(assets_by_type['gold'], 'gold')
-            crypto_stats = get_asset_totals(assets_by_type['crypto'], 'crypto')
-            investment_trust_stats = get_asset_totals(assets_by_type['investment_trust'], 'investment_trust')
-            insurance_stats = get_asset_totals(assets_by_type['insurance'], 'insurance')
+            jp_stats = get_asset_totals('jp_stock')
+            us_stats = get_asset_totals('us_stock')
+            cash_stats = get_asset_totals('cash')
+            gold_stats = get_asset_totals('gold')
+            crypto_stats = get_asset_totals('crypto')
+            investment_trust_stats = get_asset_totals('investment_trust')
+            insurance_stats = get_asset_totals('insurance')
             
-            total_assets = (jp_stats['total'] + us_stats['total'] + cash_stats['total'] + 
-                           gold_stats['total'] + crypto_stats['total'] + 
-                           investment_trust_stats['total'] + insurance_stats['total'])
+            total_assets = (jp_stats.total + us_stats.total + cash_stats.total + 
+                           gold_stats.total + crypto_stats.total + 
+                           investment_trust_stats.total + insurance_stats.total)
             
-            total_cost_excluding_cash = (jp_stats['cost'] + us_stats['cost'] + 
-                                         gold_stats['cost'] + crypto_stats['cost'] + 
-                                         investment_trust_stats['cost'] + insurance_stats['cost'])
+            total_cost_excluding_cash = (jp_stats.cost + us_stats.cost + 
+                                         gold_stats.cost + crypto_stats.cost + 
+                                         investment_trust_stats.cost + insurance_stats.cost)
             
-            total_value_excluding_cash = (jp_stats['total'] + us_stats['total'] + 
-                                          gold_stats['total'] + crypto_stats['total'] + 
-                                          investment_trust_stats['total'] + insurance_stats['total'])
+            total_value_excluding_cash = (jp_stats.total + us_stats.total + 
+                                          gold_stats.total + crypto_stats.total + 
+                                          investment_trust_stats.total + insurance_stats.total)
             
             total_profit = total_value_excluding_cash - total_cost_excluding_cash
             total_profit_rate = (total_profit / total_cost_excluding_cash * 100) if total_cost_excluding_cash > 0 else 0.0
@@ -178,30 +196,12 @@ def get_dashboard_data(user_id):
             chart_data = {
                 'labels': ['日本株', '米国株', '現金', '金', '暗号資産', '投資信託', '保険'],
                 'values': [
-                    jp_stats['total'], us_stats['total'], cash_stats['total'],
-                    gold_stats['total'], crypto_stats['total'], investment_trust_stats['total'],
-                    insurance_stats['total']
+                    jp_stats.total, us_stats.total, cash_stats.total,
+                    gold_stats.total, crypto_stats.total, investment_trust_stats.total,
+                    insurance_stats.total
                 ]
             }
             
-            # 履歴データ取得（最新365日分を降順で取得）
-            query_history = '''SELECT record_date, jp_stock_value, us_stock_value, cash_value, 
-                                   gold_value, crypto_value, investment_trust_value, 
-                                   insurance_value, total_value
-                            FROM asset_history 
-                            WHERE user_id = %s 
-                            ORDER BY record_date DESC 
-                            LIMIT 365''' if db_manager.use_postgres else '''SELECT record_date, jp_stock_value, us_stock_value, cash_value, 
-                                   gold_value, crypto_value, investment_trust_value, 
-                                   insurance_value, total_value
-                            FROM asset_history 
-                            WHERE user_id = ? 
-                            ORDER BY record_date DESC 
-                            LIMIT 365'''
-            
-            c.execute(query_history, (user_id,))
-            history = c.fetchall() or []
-            
             # 時系列順（古→新）にする
             history.reverse()
             
@@ -213,16 +213,23 @@ def get_dashboard_data(user_id):
                 except Exception:
                     return str(date_obj)
             
+            # 行を1回だけ走査して系列ごとのリストに振り分ける（値の列は数値型なので NULL だけ 0 にする）
+            dates, totals, jp, us, cash, gold, crypto, trust, insurance = [], [], [], [], [], [], [], [], []
+            _fmt = format_date
+            for h in history:
+                dates.append(_fmt(h['record_date']))
+                totals.append(h['total_value'] or 0.0)
+                jp.append(h['jp_stock_value'] or 0.0)
+                us.append(h['us_stock_value'] or 0.0)
+                cash.append(h['cash_value'] or 0.0)
+                gold.append(h['gold_value'] or 0.0)
+                crypto.append(h['crypto_value'] or 0.0)
+                trust.append(h['investment_trust_value'] or 0.0)
+                insurance.append(h['insurance_value'] or 0.0)
+            
             history_data = {
-                'dates': [format_date(h['record_date']) for h in history],
-                'total': [safe_get(h, 'total_value', 0) for h in history],
-                'jp_stock': [safe_get(h, 'jp_stock_value', 0) for h in history],
-                'us_stock': [safe_get(h, 'us_stock_value', 0) for h in history],
-                'cash': [safe_get(h, 'cash_value', 0) for h in history],
-                'gold': [safe_get(h, 'gold_value', 0) for h in history],
-                'crypto': [safe_get(h, 'crypto_value', 0) for h in history],
-                'investment_trust': [safe_get(h, 'investment_trust_value', 0) for h in history],
-                'insurance': [safe_get(h, 'insurance_value', 0) for h in history]
+                'dates': dates, 'total': totals, 'jp_stock': jp, 'us_stock': us, 'cash': cash,
+                'gold': gold, 'crypto': crypto, 'investment_trust': trust, 'insurance': insurance
             }
             
             result = {
@@ -231,62 +238,47 @@ def get_dashboard_data(user_id):
                 'total_profit_rate': total_profit_rate,
                 'total_day_change': total_day_change,
                 'total_day_change_rate': total_day_change_rate,
-                'jp_total': jp_stats['total'], 'jp_profit': jp_stats['profit'], 'jp_profit_rate': jp_stats['profit_rate'], 'jp_day_change': jp_stats['day_change'], 'jp_day_change_rate': jp_stats['day_change_rate'],
-                'us_total_jpy': us_stats['total'], 'us_total_usd': us_stats['total'] / usd_jpy if usd_jpy > 0 else 0.0, 'us_profit_jpy': us_stats['profit'], 'us_profit_rate': us_stats['profit_rate'], 'us_day_change': us_stats['day_change'], 'us_day_change_rate': us_stats['day_change_rate'],
-                'cash_total': cash_stats['total'], 'cash_day_change': cash_stats['day_change'], 'cash_day_change_rate': cash_stats['day_change_rate'],
-                'gold_total': gold_stats['total'], 'gold_profit': gold_stats['profit'], 'gold_profit_rate': gold_stats['profit_rate'], 'gold_day_change': gold_stats['day_change'], 'gold_day_change_rate': gold_stats['day_change_rate'],
-                'crypto_total': crypto_stats['total'], 'crypto_profit': crypto_stats['profit'], 'crypto_profit_rate': crypto_stats['profit_rate'], 'crypto_day_change': crypto_stats['day_change'], 'crypto_day_change_rate': crypto_stats['day_change_rate'],
-                'investment_trust_total': investment_trust_stats['total'], 'investment_trust_profit': investment_trust_stats['profit'], 'investment_trust_profit_rate': investment_trust_stats['profit_rate'], 'investment_trust_day_change': investment_trust_stats['day_change'], 'investment_trust_day_change_rate': investment_trust_stats['day_change_rate'],
-                'insurance_total': insurance_stats['total'], 'insurance_profit': insurance_stats['profit'], 'insurance_profit_rate': insurance_stats['profit_rate'], 'insurance_day_change': insurance_stats['day_change'], 'insurance_day_change_rate': insurance_stats['day_change_rate'],
-                'jp_stocks': assets_by_type['jp_stock'], 'us_stocks': assets_by_type['us_stock'], 'cash_items': assets_by_type['cash'],
-                'gold_items': assets_by_type['gold'], 'crypto_items': assets_by_type['crypto'], 'investment_trust_items': assets_by_type['investment_trust'],
-                'insurance_items': assets_by_type['insurance'],
-                'chart_data': json.dumps(chart_data),
-                'history_data': json.dumps(history_data)
+                'us_total_jpy': us_stats.total,
+                'us_total_usd': us_stats.total / usd_jpy if usd_jpy > 0 else 0.0,
+                'us_profit_jpy': us_stats.profit,
+                'chart_data': json_dumps(chart_data),
+                # 履歴は /api/history_data でのみ返す（HTML には埋め込まない）
+                'history_data': history_data
             }
+            all_stats = (jp_stats, us_stats, cash_stats, gold_stats, crypto_stats, investment_trust_stats, insurance_stats)
+            for prefix, stats in zip(_STAT_PREFIXES, all_stats):
+                for field in _STAT_FIELDS:
+                    result[f'{prefix}_{field}'] = getattr(stats, field)
             return result
         
     except Exception as e:
-        logger.error(f"❌ Error getting dashboard data: {e}", exc_info=True)
+        logger.error("❌ Error getting dashboard data: %s", e, exc_info=True)
         return None
 
 @dashboard_bp.route('/dashboard')
 def dashboard():
     """ダッシュボード"""
-    user_id = session.get('user_id')
-    if not user_id:
+    if not session.get('user_id'):
         flash('ログインしてください', 'error')
         return redirect(url_for('auth.login'))
     
     try:
-        with db_manager.get_db() as conn:
-            c = conn.cursor()
-            query = 'SELECT username FROM users WHERE id = %s' if db_manager.use_postgres else 'SELECT username FROM users WHERE id = ?'
-            c.execute(query, (user_id,))
-            user = c.fetchone()
-            
-            if not user:
-                session.clear()
-                flash('ユーザーが見つかりません', 'error')
-                return redirect(url_for('auth.login'))
-            user_name = user['username']
+        # ユーザー名はセッションから取得（同一リクエスト内では g にキャッシュ）
+        user = get_current_user()
+        if not user:
+            session.clear()
+            flash('ユーザーが見つかりません', 'error')
+            return redirect(url_for('auth.login'))
+        user_id = user['id']
+        user_name = user['username']
         
         data = get_dashboard_data(user_id)
         
         if data is None:
-            data = {
-                'total_assets': 0, 'total_profit': 0, 'total_profit_rate': 0, 'total_day_change': 0, 'total_day_change_rate': 0,
-                'jp_total': 0, 'jp_profit': 0, 'jp_profit_rate': 0, 'jp_day_change': 0, 'jp_day_change_rate': 0,
-                'us_total_jpy': 0, 'us_total_usd': 0, 'us_profit_jpy': 0, 'us_profit_rate': 0, 'us_day_change': 0, 'us_day_change_rate': 0,
-                'cash_total': 0, 'cash_day_change': 0, 'cash_day_change_rate': 0,
-                'gold_total': 0, 'gold_profit': 0, 'gold_profit_rate': 0, 'gold_day_change': 0, 'gold_day_change_rate': 0,
-                'crypto_total': 0, 'crypto_profit': 0, 'crypto_profit_rate': 0, 'crypto_day_change': 0, 'crypto_day_change_rate': 0,
-                'investment_trust_total': 0, 'investment_trust_profit': 0, 'investment_trust_profit_rate': 0, 'investment_trust_day_change': 0, 'investment_trust_day_change_rate': 0,
-                'insurance_total': 0, 'insurance_profit': 0, 'insurance_profit_rate': 0, 'insurance_day_change': 0, 'insurance_day_change_rate': 0,
-                'jp_stocks': [], 'us_stocks': [], 'cash_items': [], 'gold_items': [], 'crypto_items': [], 'investment_trust_items': [], 'insurance_items': [],
-                'chart_data': json.dumps({'labels': [], 'values': []}),
-                'history_data': json.dumps({'dates': [], 'total': [], 'jp_stock': [], 'us_stock': [], 'cash': [], 'gold': [], 'crypto': [], 'investment_trust': [], 'insurance': []})
-            }
+            data = dict.fromkeys(_DASHBOARD_NUMBER_KEYS, 0)
+            data['chart_data'] = json_dumps({'labels': [], 'values': []})
+        
+        data.pop('history_data', None)
         
         data['user_name'] = user_name
         data['datetime'] = datetime
@@ -296,6 +288,22 @@ def dashboard():
         return render_template('dashboard.html', **data)
     
     except Exception as e:
-        logger.error(f"❌ Error rendering dashboard: {e}", exc_info=True)
+        logger.error("❌ Error rendering dashboard: %s", e, exc_info=True)
         flash('ダッシュボードの読み込み中にエラーが発生しました', 'error')
         return redirect(url_for('auth.login'))
+
+@dashboard_bp.route('/api/history_data')
+def history_data():
+    """資産推移グラフ用の履歴データ（JSON）"""
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        data = get_dashboard_data(user['id'])
+        history = data['history_data'] if data else {}
+        return current_app.response_class(json_dumps(history), mimetype='application/json')
+    
+    except Exception as e:
+        logger.error("❌ Error getting history data: %s", e, exc_info=True)
+        return jsonify({'error': 'Internal error'}), 500
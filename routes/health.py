@@ -13,6 +13,11 @@ from models import db_manager
 
 health_bp = Blueprint('health', __name__)
 
+# 日次バッチで価格を取得する資産タイプとクエリ（方言はモジュール読み込み時に確定）
+_PRICED_ASSET_TYPES = ('jp_stock', 'us_stock', 'gold', 'crypto', 'investment_trust')
+_SQL_PRICED_ASSETS = db_manager.sql('SELECT id, asset_type, symbol FROM assets WHERE user_id = ? AND asset_type IN ('
+                                    + ', '.join(['?'] * len(_PRICED_ASSET_TYPES)) + ')')
+
 @health_bp.route('/ping')
 def ping():
     """スリープ防止用のエンドポイント"""
@@ -25,61 +30,50 @@ def run_daily_batch():
     try:
         # 循環参照を避けるため関数内でインポート
         from services import price_service, asset_service
+        from routes.dashboard import invalidate_dashboard
         
         with db_manager.get_db() as conn:
             c = conn.cursor()
-            if db_manager.use_postgres:
-                c.execute('SELECT id, username FROM users')
-            else:
-                c.execute('SELECT id, username FROM users')
+            c.execute('SELECT id, username FROM users')
             users = c.fetchall()
         
-        logger.info(f"👥 Found {len(users)} users for update.")
+        logger.info("👥 Found %s users for update.", len(users))
         
         for user in users:
             user_id = user['id']
             username = user['username']
-            logger.info(f"🔄 Processing user: {username} (ID: {user_id})")
+            logger.info("🔄 Processing user: %s (ID: %s)", username, user_id)
             
             try:
                 # 1. 更新対象の資産を取得
                 with db_manager.get_db() as conn:
                     c = conn.cursor()
-                    asset_types = ['jp_stock', 'us_stock', 'gold', 'crypto', 'investment_trust']
-                    ph = ', '.join(['%s'] * len(asset_types)) if db_manager.use_postgres else ', '.join(['?'] * len(asset_types))
-                    query = f"SELECT id, asset_type, symbol FROM assets WHERE user_id = {('%s' if db_manager.use_postgres else '?')} AND asset_type IN ({ph})"
-                    params = [user_id] + asset_types
-                    c.execute(query, params)
+                    c.execute(_SQL_PRICED_ASSETS, (user_id, *_PRICED_ASSET_TYPES))
                     assets = c.fetchall()
                 
                 if assets:
                     # 2. 価格更新
-                    assets_list = [{'id': int(a['id']), 'asset_type': str(a['asset_type']), 'symbol': str(a['symbol'])} for a in assets]
-                    updated_prices = price_service.fetch_prices_parallel(assets_list)
+                    updated_prices = price_service.fetch_prices_parallel(assets)
                     
                     if updated_prices:
                         with db_manager.get_db() as conn:
-                            c = conn.cursor()
-                            for p in updated_prices:
-                                if db_manager.use_postgres:
-                                    c.execute('UPDATE assets SET price = %s, name = %s WHERE id = %s', (float(p['price']), str(p.get('name','')), int(p['id'])))
-                                else:
-                                    c.execute('UPDATE assets SET price = ?, name = ? WHERE id = ?', (float(p['price']), str(p.get('name','')), int(p['id'])))
+                            asset_service.save_prices(conn, user_id, updated_prices)
                             conn.commit()
-                        logger.info(f"   ✅ Prices updated for {username}")
+                        logger.info("   ✅ Prices updated for %s", username)
                 
                 # 3. スナップショット保存
                 asset_service.record_asset_snapshot(user_id)
-                logger.info(f"   📸 Snapshot recorded for {username}")
+                invalidate_dashboard(user_id)
+                logger.info("   📸 Snapshot recorded for %s", username)
                 
             except Exception as e:
-                logger.error(f"   ❌ Error processing user {username}: {e}")
+                logger.error("   ❌ Error processing user %s: %s", username, e)
                 continue
                 
         logger.info("✅ === Batch Process Completed ===")
         
     except Exception as e:
-        logger.error(f"❌ Critical Error in Batch: {e}", exc_info=True)
+        logger.error("❌ Critical Error in Batch: %s", e, exc_info=True)
 
 def keep_alive():
     """
@@ -101,7 +95,7 @@ def keep_alive():
         try:
             requests.get(ping_url, timeout=10)
         except Exception as e:
-            logger.error(f"Keep-alive ping failed: {e}")
+            logger.error("Keep-alive ping failed: %s", e)
         
         # 2. 待機 (5分間隔)
         time.sleep(300)
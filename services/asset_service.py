@@ -1,10 +1,27 @@
 from datetime import datetime, timezone, timedelta
 import time
+import io
+import csv
 from utils import logger
 from models import db_manager
 from config import get_config
 from .price_service import price_service
 
+# 方言（? / %s）はインポート時に一度だけ解決する
+_SQL_ASSETS_BY_TYPE = db_manager.sql('SELECT * FROM assets WHERE user_id = ? AND asset_type = ?')
+_SQL_SNAPSHOT_ON = db_manager.sql('''SELECT jp_stock_value, us_stock_value, cash_value, 
+                                            gold_value, crypto_value, investment_trust_value, 
+                                            insurance_value, total_value 
+                                    FROM asset_history 
+                                    WHERE user_id = ? AND record_date = ?''')
+_PRICED_ASSET_TYPES = ['jp_stock', 'us_stock', 'gold', 'crypto', 'investment_trust']
+_SQL_PRICED_ASSETS = db_manager.sql(
+    'SELECT id, symbol, asset_type FROM assets WHERE user_id = ? AND asset_type IN ('
+    + ', '.join(['?'] * len(_PRICED_ASSET_TYPES)) + ')')
+# ユーザーの資産データの版数（資産・価格・履歴を変えたら上げる。ワーカー間で共有するキャッシュの有効性判定用）
+_SQL_BUMP_DATA_VERSION = db_manager.sql('UPDATE users SET data_version = data_version + 1 WHERE id = ?')
+_SQL_DATA_VERSION = db_manager.sql('SELECT data_version FROM users WHERE id = ?')
+
 # ================================================================================
 # 💼 資産管理サービス
 # ================================================================================
@@ -12,6 +29,9 @@ from .price_service import price_service
 class AssetService:
     """資産管理のビジネスロジック"""
     
+    # この件数以上の価格更新は COPY + 一時テーブル経由で反映する（PostgreSQL）
+    COPY_THRESHOLD = 500
+    
     def __init__(self):
         self.config = get_config()
         self.use_postgres = self.config.USE_POSTGRES
@@ -24,21 +44,17 @@ class AssetService:
         
         for attempt in range(max_retries):
             try:
-                logger.info(f"📸 === [START] Asset snapshot for user {user_id} (Attempt {attempt+1}/{max_retries}) ===")
+                logger.info("📸 === [START] Asset snapshot for user %s (Attempt %s/%s) ===", user_id, attempt+1, max_retries)
                 
                 with db_manager.get_db() as conn:
-                    # PostgreSQL/SQLiteの統一インターフェース
-                    if self.use_postgres:
-                        from psycopg2.extras import RealDictCursor
-                        c = conn.cursor(cursor_factory=RealDictCursor)
-                    else:
-                        c = conn.cursor()
+                    # get_db が行を dict で返すカーソルを既定にしているので分岐不要
+                    c = conn.cursor()
                     
                     jst = timezone(timedelta(hours=9))
                     today = datetime.now(jst).date()
                     yesterday = today - timedelta(days=1)
                     
-                    logger.info(f"📅 Date: {today}, Yesterday: {yesterday}")
+                    logger.info("📅 Date: %s, Yesterday: %s", today, yesterday)
                     
                     asset_types = ['jp_stock', 'us_stock', 'cash', 'gold', 'crypto', 'investment_trust', 'insurance']
                     values = {}
@@ -46,19 +62,14 @@ class AssetService:
                     # USD/JPYレートを取得
                     try:
                         usd_jpy = price_service.get_usd_jpy_rate()
-                        logger.info(f"💱 USD/JPY Rate: {usd_jpy}")
+                        logger.info("💱 USD/JPY Rate: %s", usd_jpy)
                     except Exception as e:
-                        logger.warning(f"⚠️ Failed to get USD/JPY rate: {e}")
+                        logger.warning("⚠️ Failed to get USD/JPY rate: %s", e)
                         usd_jpy = 150.0
                     
                     # 当日の資産値を計算
                     for asset_type in asset_types:
-                        if self.use_postgres:
-                            c.execute('SELECT * FROM assets WHERE user_id = %s AND asset_type = %s',
-                                     (user_id, asset_type))
-                        else:
-                            c.execute('SELECT * FROM assets WHERE user_id = ? AND asset_type = ?',
-                                     (user_id, asset_type))
+                        c.execute(_SQL_ASSETS_BY_TYPE, (user_id, asset_type))
                         assets = c.fetchall()
                         
                         total = 0
@@ -76,30 +87,17 @@ class AssetService:
                         values[asset_type] = total
                     
                     total_value = sum(values.values())
-                    logger.info(f"📊 Calculated Values: {values}")
-                    logger.info(f"💰 Total Value: {total_value:,.2f}")
+                    logger.info("📊 Calculated Values: %s", values)
+                    logger.info("💰 Total Value: %.2f", total_value)
                     
                     # 昨日のスナップショットを取得（前日の値として使用）
-                    if self.use_postgres:
-                        c.execute('''SELECT jp_stock_value, us_stock_value, cash_value, 
-                                            gold_value, crypto_value, investment_trust_value, 
-                                            insurance_value, total_value 
-                                    FROM asset_history 
-                                    WHERE user_id = %s AND record_date = %s''',
-                                 (user_id, yesterday))
-                    else:
-                        c.execute('''SELECT jp_stock_value, us_stock_value, cash_value, 
-                                            gold_value, crypto_value, investment_trust_value, 
-                                            insurance_value, total_value 
-                                    FROM asset_history 
-                                    WHERE user_id = ? AND record_date = ?''',
-                                 (user_id, yesterday))
+                    c.execute(_SQL_SNAPSHOT_ON, (user_id, yesterday))
                     
                     yesterday_record = c.fetchone()
                     
                     # 前日のデータがある場合はそれを使用、ない場合は0
                     if yesterday_record:
-                        logger.info(f"🔙 Found yesterday's record for comparison.")
+                        logger.info("🔙 Found yesterday's record for comparison.")
                         prev_values = {
                             'jp_stock': float(yesterday_record['jp_stock_value'] or 0),
                             'us_stock': float(yesterday_record['us_stock_value'] or 0),
@@ -111,7 +109,7 @@ class AssetService:
                         }
                         prev_total_value = float(yesterday_record['total_value'] or 0)
                     else:
-                        logger.info(f"🆕 No yesterday's record. Using current values as previous.")
+                        logger.info("🆕 No yesterday's record. Using current values as previous.")
                         prev_values = {
                             'jp_stock': values['jp_stock'],
                             'us_stock': values['us_stock'],
@@ -175,80 +173,110 @@ class AssetService:
                                   prev_values['insurance'], prev_total_value))
                     
                     conn.commit()
-                    logger.info(f"✅ [COMMIT] Transaction committed for user {user_id}")
-                    logger.info(f"✅ Asset snapshot completed successfully")
+                    logger.info("✅ [COMMIT] Transaction committed for user %s", user_id)
+                    logger.info("✅ Asset snapshot completed successfully")
                     return # 成功したら終了
                 
             except Exception as e:
-                logger.error(f"⚠️ [ERROR] Snapshot failed (Attempt {attempt+1}): {e}", exc_info=True)
+                logger.error("⚠️ [ERROR] Snapshot failed (Attempt %s): %s", attempt+1, e, exc_info=True)
                 if attempt < max_retries - 1:
                     time.sleep(retry_delay * (attempt + 1))
                 else:
-                    logger.error(f"❌ Failed to record asset snapshot after {max_retries} attempts")
+                    logger.error("❌ Failed to record asset snapshot after %s attempts", max_retries)
                     raise
     
+    def bump_data_version(self, user_id):
+        """ユーザーの資産データの版数を上げる（各ワーカーのダッシュボードキャッシュが次の表示で作り直される）"""
+        with db_manager.get_db() as conn:
+            conn.cursor().execute(_SQL_BUMP_DATA_VERSION, (user_id,))
+            conn.commit()
+    
+    def get_data_version(self, user_id):
+        """ユーザーの資産データの版数を取得（ユーザーがいなければ None）"""
+        with db_manager.get_db() as conn:
+            c = conn.cursor()
+            c.execute(_SQL_DATA_VERSION, (user_id,))
+            row = c.fetchone()
+        return row['data_version'] if row else None
+    
+    def save_prices(self, conn, user_id, updated_prices):
+        """取得した価格を1回のバッチでDBに反映（コミットは呼び出し側）
+        
+        更新は user_id の資産に限定する（取得中に削除・付け替えされた id を書き換えない）
+        """
+        if db_manager.use_postgres and len(updated_prices) >= self.COPY_THRESHOLD:
+            # 大量の場合：COPY で一時テーブルに流し込み、UPDATE ... FROM で1回だけ結合
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            for p in updated_prices:
+                writer.writerow((int(p['id']), float(p['price']), str(p.get('name', ''))))
+            buf.seek(0)
+            
+            c = db_manager.batch_cursor(conn)
+            c.execute('CREATE TEMP TABLE tmp_prices (id INTEGER, price DOUBLE PRECISION, name TEXT) ON COMMIT DROP')
+            c.copy_expert('COPY tmp_prices (id, price, name) FROM STDIN WITH (FORMAT csv)', buf)
+            c.execute('''UPDATE assets AS a SET price = t.price, name = t.name, last_price_update = CURRENT_TIMESTAMP
+                         FROM tmp_prices AS t
+                         WHERE a.id = t.id AND a.user_id = %s''', (user_id,))
+        elif db_manager.use_postgres:
+            # PostgreSQLの場合：execute_valuesで複数行を1文にまとめてUPDATE
+            from psycopg2.extras import execute_values
+            update_data = [(int(p['id']), float(p['price']), str(p.get('name', '')), user_id) for p in updated_prices]
+            execute_values(
+                db_manager.batch_cursor(conn),
+                '''UPDATE assets AS a SET price = v.price, name = v.name, last_price_update = CURRENT_TIMESTAMP
+                   FROM (VALUES %s) AS v(id, price, name, user_id)
+                   WHERE a.id = v.id AND a.user_id = v.user_id''',
+                update_data,
+                template='(%s, %s::double precision, %s, %s)',
+                page_size=500
+            )
+        else:
+            # SQLiteの場合：executemanyを使用
+            update_data = [(float(p['price']), str(p.get('name', '')), int(p['id']), user_id) for p in updated_prices]
+            conn.cursor().executemany('UPDATE assets SET price = ?, name = ?, last_price_update = CURRENT_TIMESTAMP WHERE id = ? AND user_id = ?', update_data)
+    
     def update_user_prices(self, user_id):
         """特定ユーザーの全資産価格を更新（並列処理）"""
         try:
-            logger.info(f"⚡ === Starting price update for user {user_id} ===")
+            logger.info("⚡ === Starting price update for user %s ===", user_id)
             
             with db_manager.get_db() as conn:
-                if self.use_postgres:
-                    from psycopg2.extras import RealDictCursor
-                    c = conn.cursor(cursor_factory=RealDictCursor)
-                else:
-                    c = conn.cursor()
-                
-                asset_types_to_update = ['jp_stock', 'us_stock', 'gold', 'crypto', 'investment_trust']
+                c = conn.cursor()
                 
-                query_placeholder = ', '.join(['%s'] * len(asset_types_to_update)) if self.use_postgres else ', '.join(['?'] * len(asset_types_to_update))
-                
-                if self.use_postgres:
-                    c.execute(f'SELECT id, symbol, asset_type FROM assets WHERE user_id = %s AND asset_type IN ({query_placeholder})',
-                             [user_id] + asset_types_to_update)
-                else:
-                    c.execute(f'SELECT id, symbol, asset_type FROM assets WHERE user_id = ? AND asset_type IN ({query_placeholder})',
-                             [user_id] + asset_types_to_update)
+                c.execute(_SQL_PRICED_ASSETS, [user_id] + _PRICED_ASSET_TYPES)
                 
                 all_assets = c.fetchall()
                 
                 if not all_assets:
-                    logger.info(f"ℹ️ No assets to update for user {user_id}")
+                    logger.info("ℹ️ No assets to update for user %s", user_id)
                     return 0
                 
-                logger.info(f"📦 Found {len(all_assets)} assets to update")
+                logger.info("📦 Found %s assets to update", len(all_assets))
                 
                 # 並列処理で価格を取得
                 updated_prices = price_service.fetch_prices_parallel(all_assets)
                 
                 if updated_prices:
-                    logger.info(f"💾 Updating {len(updated_prices)} assets in database...")
+                    logger.info("💾 Updating %s assets in database...", len(updated_prices))
                     
                     try:
-                        if self.use_postgres:
-                            # PostgreSQLの場合：個別にUPDATE
-                            for price_data in updated_prices:
-                                c.execute('UPDATE assets SET price = %s, name = %s WHERE id = %s',
-                                         (float(price_data['price']), str(price_data.get('name', '')), int(price_data['id'])))
-                        else:
-                            # SQLiteの場合：executemanyを使用
-                            update_data = [(float(p['price']), str(p.get('name', '')), int(p['id'])) for p in updated_prices]
-                            c.executemany('UPDATE assets SET price = ?, name = ? WHERE id = ?', update_data)
+                        self.save_prices(conn, user_id, updated_prices)
                         
                         # ✅ 明示的にコミット
                         conn.commit()
-                        logger.info(f"✅ Database update committed")
+                        logger.info("✅ Database update committed")
                         
                     except Exception as update_error:
-                        logger.error(f"❌ Error updating database: {update_error}", exc_info=True)
+                        logger.error("❌ Error updating database: %s", update_error, exc_info=True)
                         conn.rollback()
                         raise
                 
-                logger.info(f"✅ === Price update completed: {len(updated_prices)}/{len(all_assets)} assets updated ===")
+                logger.info("✅ === Price update completed: %s/%s assets updated ===", len(updated_prices), len(all_assets))
                 return len(updated_prices)
         
         except Exception as e:
-            logger.error(f"❌ Error updating prices for user {user_id}: {e}", exc_info=True)
+            logger.error("❌ Error updating prices for user %s: %s", user_id, e, exc_info=True)
             return 0
 
 # グローバルサービスインスタンス
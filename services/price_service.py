@@ -1,17 +1,60 @@
 import requests
 from bs4 import BeautifulSoup
+try:
+    import httpx
+except ImportError:
+    httpx = None
 import time
 import random
 import concurrent.futures
+import logging
 from utils import logger, cache
 import re
 import json
 
+def _build_http_client():
+    """全銘柄で共有するHTTPクライアントを作成
+    
+    httpx（+h2）があれば HTTP/2 多重化の接続プールを使い、TCP/TLS ハンドシェイクを銘柄ごとに張り直さない
+    """
+    if httpx is not None:
+        try:
+            return httpx.Client(
+                http2=True,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=50)
+            )
+        except ImportError:
+            logger.warning("⚠️ h2 not installed, falling back to requests.Session")
+    return requests.Session()
+
+def _apparent_text(response):
+    """本文から文字コードを推定してデコード（文字化け対策）"""
+    import charset_normalizer
+    best = charset_normalizer.from_bytes(response.content).best()
+    return str(best) if best is not None else response.text
+
+def _unpack_asset(asset):
+    """行（dict 系）または (id, asset_type, symbol) タプルから3項目を取り出す"""
+    if hasattr(asset, 'keys'):
+        return asset['id'], asset['asset_type'], asset['symbol']
+    if isinstance(asset, (tuple, list)):
+        return tuple(asset[:3])
+    return None
+
 class PriceService:
     def __init__(self, config):
         self.config = config
-        self.cache = cache.SimpleCache(duration=300)  # 5分キャッシュ
-        self.session = requests.Session()
+        self.cache = cache.SimpleCache(duration=300, maxsize=1024)  # 5分キャッシュ（最大1024銘柄）
+        self.session = _build_http_client()
+        # USD/JPY 取得失敗時に返す直近の値と、その短期キャッシュ
+        self._last_usd_jpy = 150.0
+        self._usd_jpy_fallback_cache = cache.SimpleCache(duration=60, maxsize=1)
+        # 取得用スレッドはプロセス全体で使い回す（リクエストごとにスレッドを生成・破棄しない）
+        # 上限は全ユーザー合計の同時取得数で、取得元への負荷もここで頭打ちになる
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.MAX_WORKERS, thread_name_prefix='price-fetch'
+        )
         
         # User-Agentをランダム化 (PCブラウザとして振る舞う)
         self.user_agents = [
@@ -31,14 +74,14 @@ class PriceService:
         })
     
     def fetch_price(self, asset):
-        """単一資産の価格を取得"""
+        """単一資産の価格を取得
+        
+        asset は id/asset_type/symbol を持つ行（dict 系）か (id, asset_type, symbol) のタプル
+        """
         try:
-            if hasattr(asset, 'keys'): asset_dict = dict(asset)
-            elif isinstance(asset, dict): asset_dict = asset
-            else: return None
-            
-            asset_type = asset_dict['asset_type']
-            symbol = asset_dict['symbol']
+            unpacked = _unpack_asset(asset)
+            if unpacked is None: return None
+            asset_id, asset_type, symbol = unpacked
             
             if asset_type in ['cash', 'insurance']: return None
             
@@ -47,7 +90,7 @@ class PriceService:
             cached = self.cache.get(cache_key)
             if cached:
                 return {
-                    'id': asset_dict['id'],
+                    'id': asset_id,
                     'symbol': symbol,
                     'price': cached['price'],
                     'name': cached.get('name', symbol)
@@ -72,35 +115,48 @@ class PriceService:
                 elif asset_type == 'investment_trust':
                     price, name = self._fetch_investment_trust(symbol)
             except Exception as e:
-                logger.warning(f"⚠️ Failed to fetch price for {symbol}: {e}")
+                logger.warning("⚠️ Failed to fetch price for %s: %s", symbol, e)
                 return None
             
             if price > 0:
                 self.cache.set(cache_key, {'price': price, 'name': name})
-                return {'id': asset_dict['id'], 'symbol': symbol, 'price': price, 'name': name}
+                return {'id': asset_id, 'symbol': symbol, 'price': price, 'name': name}
             
             return None
         
         except Exception as e:
-            logger.error(f"❌ Error in fetch_price: {e}", exc_info=True)
+            logger.error("❌ Error in fetch_price: %s", e)
             return None
     
     def fetch_prices_parallel(self, assets):
-        """並列取得"""
+        """並列取得（DBの行をそのまま渡せる。中間の dict 変換は不要）"""
         if not assets: return []
-        max_workers = min(5, len(assets))
+        
+        # 同じ (asset_type, symbol) は1回だけ取得し、結果を該当する全IDに配る
+        ids_by_key = {}
+        for asset in assets:
+            unpacked = _unpack_asset(asset)
+            if unpacked is None: continue
+            asset_id, asset_type, symbol = unpacked
+            ids_by_key.setdefault((asset_type, symbol), []).append(asset_id)
+        if not ids_by_key: return []
+        
         updated_prices = []
+        futures = [self.executor.submit(self.fetch_price, (key, key[0], key[1])) for key in ids_by_key]
         try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                future_to_asset = {executor.submit(self.fetch_price, asset): asset for asset in assets}
-                for future in concurrent.futures.as_completed(future_to_asset, timeout=180):
-                    try:
-                        result = future.result(timeout=15)
-                        if result: updated_prices.append(result)
-                    except Exception: continue
+            for future in concurrent.futures.as_completed(futures, timeout=180):
+                try:
+                    result = future.result(timeout=15)
+                    if result:
+                        for asset_id in ids_by_key[result['id']]:
+                            updated_prices.append({**result, 'id': asset_id})
+                except Exception: continue
             return updated_prices
         except Exception as e:
-            logger.error(f"❌ Parallel fetch error: {e}")
+            # タイムアウト時は未着手の取得を取り消して共有プールを空ける
+            for future in futures:
+                future.cancel()
+            logger.error("❌ Parallel fetch error: %s", e)
             return updated_prices
 
     def _fetch_jp_stock(self, symbol):
@@ -119,7 +175,7 @@ class PriceService:
                 title_tag = soup.find('title')
                 if title_tag:
                     raw_title = title_tag.get_text(strip=True)
-                    logger.debug(f"🔍 Raw JP Title: {raw_title}")
+                    logger.debug("🔍 Raw JP Title: %s", raw_title)
                     
                     # '【' で分割して左側を取得 -> "(株)エス・サイエンス"
                     if '【' in raw_title:
@@ -128,7 +184,7 @@ class PriceService:
                         cleaned_name = name_part.replace('(株)', '').replace('（株）', '').strip()
                         if cleaned_name:
                             name = cleaned_name
-                            logger.info(f"✅ Extracted JP Name from Title: {name}")
+                            logger.info("✅ Extracted JP Name from Title: %s", name)
             
             # 2. 価格取得 (API)
             api_url = f"https://query1.finance.yahoo.com/v8/finance/chart/{symbol}.T"
@@ -148,7 +204,7 @@ class PriceService:
             raise ValueError("Price not found")
             
         except Exception as e:
-            logger.error(f"❌ JP Stock Error ({symbol}): {e}")
+            logger.error("❌ JP Stock Error (%s): %s", symbol, e)
             raise
 
     def _fetch_crypto(self, symbol):
@@ -159,7 +215,7 @@ class PriceService:
             # サポートされている銘柄チェック
             supported_symbols = ['BTC', 'ETH', 'XRP', 'DOGE']
             if symbol not in supported_symbols:
-                logger.warning(f"Unsupported crypto symbol requested: {symbol}")
+                logger.warning("Unsupported crypto symbol requested: %s", symbol)
                 raise ValueError(f"Unsupported crypto: {symbol}")
             
             url = f"https://cc.minkabu.jp/pair/{symbol}_JPY"
@@ -168,8 +224,7 @@ class PriceService:
             }
             
             response = self.session.get(url, headers=headers, timeout=10)
-            response.encoding = response.apparent_encoding
-            text = response.text
+            text = _apparent_text(response)
             
             # ヘルパー関数: 文字列から数値を抽出
             def extract_number_from_string(s):
@@ -192,7 +247,7 @@ class PriceService:
                 for jm in json_matches:
                     val = extract_number_from_string(jm)
                     if val is not None and val > 0:
-                        logger.debug(f"Found price in JSON-like field: {jm} -> {val}")
+                        logger.debug("Found price in JSON-like field: %s -> %s", jm, val)
                         name_map = {
                             'BTC': 'ビットコイン',
                             'ETH': 'イーサリアム',
@@ -200,7 +255,7 @@ class PriceService:
                             'DOGE': 'ドージコイン'
                         }
                         name = name_map.get(symbol, symbol)
-                        logger.info(f"✅ Crypto from みんかぶ (JSON): {symbol} = ¥{val:,.2f}")
+                        logger.info("✅ Crypto from みんかぶ (JSON): %s = ¥%.2f", symbol, val)
                         return round(val, 2), name
             
             # ✅ 方法2: 「現在値」の近くから価格を抽出
@@ -218,7 +273,7 @@ class PriceService:
                             'DOGE': 'ドージコイン'
                         }
                         name = name_map.get(symbol, symbol)
-                        logger.info(f"✅ Crypto from みんかぶ (現在値): {symbol} = ¥{val:,.2f}")
+                        logger.info("✅ Crypto from みんかぶ (現在値): %s = ¥%.2f", symbol, val)
                         return round(val, 2), name
             
             # ✅ 方法3: data-price属性から抽出
@@ -233,7 +288,7 @@ class PriceService:
                         'DOGE': 'ドージコイン'
                     }
                     name = name_map.get(symbol, symbol)
-                    logger.info(f"✅ Crypto from みんかぶ (data-price): {symbol} = ¥{val:,.2f}")
+                    logger.info("✅ Crypto from みんかぶ (data-price): %s = ¥%.2f", symbol, val)
                     return round(val, 2), name
             
             # ✅ 方法4: BeautifulSoupでCSSセレクタから抽出
@@ -251,7 +306,7 @@ class PriceService:
                         txt = tag.get_text(' ', strip=True)
                         val = extract_number_from_string(txt)
                         if val is not None and val > 0:
-                            logger.debug(f"Found price by selector {sel}: {txt} -> {val}")
+                            logger.debug("Found price by selector %s: %s -> %s", sel, txt, val)
                             name_map = {
                                 'BTC': 'ビットコイン',
                                 'ETH': 'イーサリアム',
@@ -259,7 +314,7 @@ class PriceService:
                                 'DOGE': 'ドージコイン'
                             }
                             name = name_map.get(symbol, symbol)
-                            logger.info(f"✅ Crypto from みんかぶ (selector {sel}): {symbol} = ¥{val:,.2f}")
+                            logger.info("✅ Crypto from みんかぶ (selector %s): %s = ¥%.2f", sel, symbol, val)
                             return round(val, 2), name
                 except Exception:
                     continue
@@ -276,7 +331,7 @@ class PriceService:
                         'DOGE': 'ドージコイン'
                     }
                     name = name_map.get(symbol, symbol)
-                    logger.info(f"✅ Crypto from みんかぶ (円): {symbol} = ¥{val:,.2f}")
+                    logger.info("✅ Crypto from みんかぶ (円): %s = ¥%.2f", symbol, val)
                     return round(val, 2), name
             
             # ✅ 方法6: 科学的記数法（1.23e+6など）
@@ -284,7 +339,7 @@ class PriceService:
             if m2:
                 val = extract_number_from_string(m2.group(1))
                 if val is not None and val > 0:
-                    logger.debug(f"Found price by scientific notation: {m2.group(1)} -> {val}")
+                    logger.debug("Found price by scientific notation: %s -> %s", m2.group(1), val)
                     name_map = {
                         'BTC': 'ビットコイン',
                         'ETH': 'イーサリアム',
@@ -292,18 +347,19 @@ class PriceService:
                         'DOGE': 'ドージコイン'
                     }
                     name = name_map.get(symbol, symbol)
-                    logger.info(f"✅ Crypto from みんかぶ (scientific): {symbol} = ¥{val:,.2f}")
+                    logger.info("✅ Crypto from みんかぶ (scientific): %s = ¥%.2f", symbol, val)
                     return round(val, 2), name
             
             # すべて失敗した場合
-            logger.warning(f"⚠️ Failed to parse crypto price for {symbol}")
-            snippet = text[:1200].replace('\n', ' ')
-            logger.debug(f"HTML snippet:\n{snippet}\n--- end snippet ---")
+            logger.warning("⚠️ Failed to parse crypto price for %s", symbol)
+            if logger.isEnabledFor(logging.DEBUG):
+                snippet = text[:1200].replace('\n', ' ')
+                logger.debug("HTML snippet:\n%s\n--- end snippet ---", snippet)
             
             raise ValueError(f"Crypto price not found for {symbol}")
         
         except Exception as e:
-            logger.error(f"❌ Error getting crypto {symbol}: {e}")
+            logger.error("❌ Error getting crypto %s: %s", symbol, e)
             raise
 
     def _fetch_us_stock(self, symbol):
@@ -328,9 +384,9 @@ class PriceService:
                         name_part = raw_title.split('【')[0]
                         if name_part:
                             name = name_part.strip()
-                            logger.info(f"✅ Extracted US Name from JP Title: {name}")
+                            logger.info("✅ Extracted US Name from JP Title: %s", name)
         except Exception as e:
-            logger.warning(f"⚠️ Failed to scrape US stock name for {symbol}: {e}")
+            logger.warning("⚠️ Failed to scrape US stock name for %s: %s", symbol, e)
 
         # 2. 価格取得 (Yahoo Finance API)
         try:
@@ -361,14 +417,14 @@ class PriceService:
                     name = meta.get('shortName') or meta.get('longName') or symbol
                 
                 if price_usd > 0:
-                    logger.info(f"✅ US Stock: {symbol} ({name}) = ${price_usd:.2f}")
+                    logger.info("✅ US Stock: %s (%s) = $%.2f", symbol, name, price_usd)
                     # ✅ USDのまま返す（旧コードと同じ）
                     return round(float(price_usd), 2), name
             
             raise ValueError(f"Price not found for {symbol}")
         
         except Exception as e:
-            logger.error(f"❌ Error getting US stock {symbol}: {e}")
+            logger.error("❌ Error getting US stock %s: %s", symbol, e)
             raise
 
     def _fetch_precious_metal_price(self, symbol):
@@ -382,8 +438,7 @@ class PriceService:
             }
             
             response = self.session.get(url, headers=headers, timeout=10)
-            response.encoding = response.apparent_encoding  # 文字化け対策
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = BeautifulSoup(_apparent_text(response), 'html.parser')
             
             # 検索対象の文字 (日本語)
             target_metal_name = '金'
@@ -428,13 +483,13 @@ class PriceService:
             
             if found_price is not None:
                 name = display_names.get(symbol, f"{symbol}")
-                logger.info(f"✅ Precious Metal found ({target_metal_name} - 買取): {name} = {found_price}")
+                logger.info("✅ Precious Metal found (%s - 買取): %s = %s", target_metal_name, name, found_price)
                 return found_price, name
                     
             raise ValueError(f"{symbol} price not found on page")
             
         except Exception as e:
-            logger.error(f"Error precious metal ({symbol}): {e}")
+            logger.error("Error precious metal (%s): %s", symbol, e)
             raise
 
     def _fetch_investment_trust(self, symbol):
@@ -449,19 +504,29 @@ class PriceService:
                 if val: return float(val.group(1).replace(',', '')), symbol
             raise ValueError("Fund price not found")
         except Exception as e:
-            logger.error(f"Error fund {symbol}: {e}")
+            logger.error("Error fund %s: %s", symbol, e)
             raise
 
     def get_usd_jpy_rate(self):
+        """USD/JPY レート（5分キャッシュ）
+        
+        取得に失敗した場合も直近の値（なければ 150.0）を1分間キャッシュし、
+        API 障害中にダッシュボード表示のたびにタイムアウトまで待たないようにする
+        """
+        cached = self.cache.get("USD_JPY") or self._usd_jpy_fallback_cache.get("USD_JPY")
+        if cached: return cached['rate']
         try:
-            cached = self.cache.get("USD_JPY")
-            if cached: return cached['rate']
             api_url = "https://query1.finance.yahoo.com/v8/finance/chart/USDJPY=X"
             data = self.session.get(api_url, timeout=10).json()
             rate = data['chart']['result'][0]['meta']['regularMarketPrice']
             self.cache.set("USD_JPY", {'rate': rate})
+            self._last_usd_jpy = rate
+            return rate
+        except Exception as e:
+            logger.warning("⚠️ Failed to get USD/JPY rate: %s", e)
+            rate = self._last_usd_jpy
+            self._usd_jpy_fallback_cache.set("USD_JPY", {'rate': rate})
             return rate
-        except: return 150.0
 
 from config import get_config
 price_service = PriceService(get_config())
\ No newline at end of file
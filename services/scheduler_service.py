@@ -13,6 +13,31 @@ from config import get_config
 # ⏰ スケジューラー関連
 # ================================================================================
 
+# 画面から依頼されたジョブの状態は DB に持つ（gunicorn の別ワーカーにポーリングが届いても参照できるように）
+# 待機中・実行中のままこの秒数を超えたジョブは、ワーカーの停止などで取り残されたものとして再実行を許可する
+_USER_JOB_STALE_SECONDS = 600
+# 終了したジョブの状態を保持する秒数
+_USER_JOB_KEEP_SECONDS = 3600
+if db_manager.use_postgres:
+    _AGE_COND = "updated_at < CURRENT_TIMESTAMP - INTERVAL '{} seconds'"
+else:
+    _AGE_COND = "updated_at < datetime('now', '-{} seconds')"
+
+# 同じ job_id が待機中・実行中でなければ 'queued' で登録し直す（登録できたときだけ行が返る）
+_SQL_CLAIM_USER_JOB = db_manager.sql('''INSERT INTO user_jobs (job_id, user_id, status, result, error, updated_at)
+                                        VALUES (?, ?, 'queued', NULL, NULL, CURRENT_TIMESTAMP)
+                                        ON CONFLICT (job_id) DO UPDATE
+                                        SET user_id = excluded.user_id, status = 'queued', result = NULL, error = NULL,
+                                            updated_at = CURRENT_TIMESTAMP
+                                        WHERE user_jobs.status NOT IN ('queued', 'running') OR user_jobs.'''
+                                     + _AGE_COND.format(_USER_JOB_STALE_SECONDS) + '''
+                                        RETURNING job_id''')
+_SQL_PRUNE_USER_JOBS = db_manager.sql("DELETE FROM user_jobs WHERE status IN ('done', 'failed') AND "
+                                      + _AGE_COND.format(_USER_JOB_KEEP_SECONDS))
+_SQL_UPDATE_USER_JOB = db_manager.sql('''UPDATE user_jobs SET status = ?, result = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+                                         WHERE job_id = ?''')
+_SQL_GET_USER_JOB = db_manager.sql('SELECT user_id, status, result, error FROM user_jobs WHERE job_id = ?')
+
 class SchedulerManager:
     """スケジューラーを管理"""
     
@@ -22,6 +47,66 @@ class SchedulerManager:
         self.use_postgres = self.config.USE_POSTGRES
         self.session = requests.Session()
     
+    def submit_user_job(self, job_id, user_id, func, *args):
+        """ユーザー操作起点の処理をバックグラウンドで即時実行し、ジョブIDを返す
+        
+        同じ job_id のジョブが（どのワーカーでも）待機中・実行中なら新たには起動しない。
+        スケジューラーが動いていない場合はその場で実行し、終了した状態を記録してから返す
+        """
+        with db_manager.get_db() as conn:
+            c = conn.cursor()
+            c.execute(_SQL_PRUNE_USER_JOBS)
+            c.execute(_SQL_CLAIM_USER_JOB, (job_id, user_id))
+            claimed = c.fetchone()
+            conn.commit()
+        
+        if not claimed:
+            return job_id
+        
+        if self.scheduler.running:
+            try:
+                self.scheduler.add_job(
+                    func=self._run_user_job,
+                    args=(job_id, func) + args,
+                    id=job_id,
+                    name=f'User job {job_id}',
+                    replace_existing=True,
+                    max_instances=1,
+                    misfire_grace_time=None
+                )
+                logger.info(f"📨 Background job queued: {job_id}")
+                return job_id
+            except Exception as e:
+                logger.warning(f"⚠️ Could not queue background job {job_id}, running inline: {e}")
+        else:
+            logger.warning(f"⚠️ Scheduler is not running, running job inline: {job_id}")
+        
+        self._run_user_job(job_id, func, *args)
+        return job_id
+    
+    def get_user_job(self, job_id):
+        """バックグラウンドジョブの状態を取得（存在しなければ None）"""
+        with db_manager.get_db() as conn:
+            c = conn.cursor()
+            c.execute(_SQL_GET_USER_JOB, (job_id,))
+            return c.fetchone()
+    
+    def _update_user_job(self, job_id, status, result=None, error=None):
+        with db_manager.get_db() as conn:
+            conn.cursor().execute(_SQL_UPDATE_USER_JOB, (status, result, error, job_id))
+            conn.commit()
+    
+    def _run_user_job(self, job_id, func, *args):
+        """バックグラウンドジョブ本体（結果・エラーを状態に記録）"""
+        self._update_user_job(job_id, 'running')
+        try:
+            result = func(*args)
+            self._update_user_job(job_id, 'done', result=result)
+            logger.info(f"✅ Background job finished: {job_id}")
+        except Exception as e:
+            self._update_user_job(job_id, 'failed', error=str(e))
+            logger.error(f"❌ Background job failed: {job_id}: {e}", exc_info=True)
+    
     def scheduled_update_all_prices(self):
         """スケジュール実行: 全ユーザーの資産価格を更新"""
         try:
@@ -63,6 +148,8 @@ class SchedulerManager:
                     # ステップ2: スナップショット記録
                     logger.info(f"📸 Step 2/2: Recording snapshot for user {username}...")
                     asset_service.record_asset_snapshot(user_id)
+                    # 価格・履歴が変わったので、各ワーカーのダッシュボードキャッシュを無効にする
+                    asset_service.bump_data_version(user_id)
                     logger.info(f"✅ Step 2 completed: Snapshot recorded")
                     
                     success_count += 1
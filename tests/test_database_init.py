@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from config import DevelopmentConfig
+from models.database import DatabaseManager
+
+# display_order / last_price_update / prev_* カラムがない頃のスキーマ
+_LEGACY_SCHEMA = '''
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE assets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    asset_type TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    name TEXT,
+    quantity REAL NOT NULL,
+    price REAL DEFAULT 0,
+    avg_cost REAL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE asset_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    record_date DATE NOT NULL,
+    jp_stock_value REAL DEFAULT 0,
+    us_stock_value REAL DEFAULT 0,
+    cash_value REAL DEFAULT 0,
+    gold_value REAL DEFAULT 0,
+    crypto_value REAL DEFAULT 0,
+    investment_trust_value REAL DEFAULT 0,
+    insurance_value REAL DEFAULT 0,
+    total_value REAL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id, record_date)
+);
+INSERT INTO users (username, password_hash) VALUES ('legacy', 'x');
+INSERT INTO assets (user_id, asset_type, symbol, quantity) VALUES (1, 'jp_stock', '7203', 100);
+'''
+
+
+class SqliteLegacySchemaTest(unittest.TestCase):
+    """既存（旧スキーマ）の SQLite DB に対する init_database"""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+        conn = sqlite3.connect('portfolio.db')
+        conn.executescript(_LEGACY_SCHEMA)
+        conn.close()
+
+        config = DevelopmentConfig()
+        config.USE_POSTGRES = False
+        self.db = DatabaseManager(config)
+
+    def tearDown(self):
+        self.db.close_pool()
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def test_init_migrates_columns_and_creates_indexes(self):
+        self.db.init_database()
+
+        with self.db.get_db() as conn:
+            c = conn.cursor()
+            c.execute('PRAGMA table_info(assets)')
+            columns = {row['name'] for row in c.fetchall()}
+            c.execute('PRAGMA table_info(users)')
+            user_columns = {row['name'] for row in c.fetchall()}
+            c.execute('PRAGMA index_list(assets)')
+            indexes = {row['name'] for row in c.fetchall()}
+            c.execute('SELECT symbol, display_order FROM assets')
+            rows = c.fetchall()
+
+        self.assertIn('display_order', columns)
+        self.assertIn('last_price_update', columns)
+        self.assertIn('data_version', user_columns)
+        self.assertIn('idx_assets_user_type_order', indexes)
+        self.assertEqual(rows, [{'symbol': '7203', 'display_order': 0}])
+
+    def test_init_is_idempotent(self):
+        self.db.init_database()
+        self.db.init_database()
+
+
+if __name__ == '__main__':
+    unittest.main()
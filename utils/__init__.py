@@ -5,10 +5,13 @@ from .constants import (
     INSURANCE_TYPES, ASSET_TYPES, ASSET_TYPE_LABELS, ASSET_TYPE_INFO
 )
 from .text_parser import normalize_fullwidth, extract_number_from_string, clean_stock_name
+from .passwords import hash_password, hash_passwords, verify_password
+from .fast_json import json_dumps
 
 __all__ = [
     'logger', 'setup_logger', 'price_cache', 'SimpleCache',
     'CRYPTO_SYMBOLS', 'INVESTMENT_TRUST_INFO', 'INVESTMENT_TRUST_SYMBOLS',
     'INSURANCE_TYPES', 'ASSET_TYPES', 'ASSET_TYPE_LABELS', 'ASSET_TYPE_INFO',
-    'normalize_fullwidth', 'extract_number_from_string', 'clean_stock_name'
+    'normalize_fullwidth', 'extract_number_from_string', 'clean_stock_name',
+    'hash_password', 'hash_passwords', 'verify_password', 'json_dumps'
 ]
\ No newline at end of file
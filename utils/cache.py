@@ -1,4 +1,6 @@
 import time
+import threading
+from collections import OrderedDict
 from config import get_config
 
 # ================================================================================
@@ -6,39 +8,53 @@ from config import get_config
 # ================================================================================
 
 class SimpleCache:
-    """シンプルなメモリキャッシュ"""
+    """シンプルなメモリキャッシュ（TTL付き、maxsize 指定時は LRU で上限管理）"""
     
-    def __init__(self, duration=None):
-        self.cache = {}
+    def __init__(self, duration=None, maxsize=None):
+        self.cache = OrderedDict()
         self.expiry = {}
         self.duration = duration or get_config().CACHE_DURATION
+        self.maxsize = maxsize
+        self._lock = threading.RLock()
     
     def get(self, key):
         """キャッシュから値を取得"""
-        if key in self.cache:
-            if time.time() < self.expiry.get(key, 0):
-                return self.cache[key]
-            else:
-                # 期限切れ
-                del self.cache[key]
-                del self.expiry[key]
-        return None
+        with self._lock:
+            if key in self.cache:
+                if time.time() < self.expiry.get(key, 0):
+                    if self.maxsize:
+                        self.cache.move_to_end(key)
+                    return self.cache[key]
+                else:
+                    # 期限切れ
+                    del self.cache[key]
+                    del self.expiry[key]
+            return None
     
     def set(self, key, value):
         """キャッシュに値を保存"""
-        self.cache[key] = value
-        self.expiry[key] = time.time() + self.duration
+        with self._lock:
+            self.cache[key] = value
+            self.expiry[key] = time.time() + self.duration
+            if self.maxsize:
+                self.cache.move_to_end(key)
+                # 上限を超えたら最も古く使われたものから削除
+                while len(self.cache) > self.maxsize:
+                    oldest, _ = self.cache.popitem(last=False)
+                    del self.expiry[oldest]
     
     def clear(self):
         """キャッシュをクリア"""
-        self.cache.clear()
-        self.expiry.clear()
+        with self._lock:
+            self.cache.clear()
+            self.expiry.clear()
     
     def delete(self, key):
         """特定のキーを削除"""
-        if key in self.cache:
-            del self.cache[key]
-            del self.expiry[key]
+        with self._lock:
+            if key in self.cache:
+                del self.cache[key]
+                del self.expiry[key]
 
 # グローバルキャッシュインスタンス
 price_cache = SimpleCache()
\ No newline at end of file
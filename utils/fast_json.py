@@ -0,0 +1,16 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ================================================================================
+# ⚡ JSON シリアライズ
+# ================================================================================
+
+def json_dumps(obj):
+    """JSON 文字列に変換（orjson があれば使い、数値の多い履歴データも高速に書き出す）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(obj)
@@ -1,5 +1,8 @@
 import logging
+import logging.handlers
 import os
+import queue
+import atexit
 
 # ================================================================================
 # 📝 ロギング設定
@@ -24,7 +27,13 @@ def setup_logger(name, level=logging.INFO):
     console_handler = logging.StreamHandler()
     console_handler.setLevel(level)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    
+    # 出力は専用スレッドに任せ、リクエスト処理スレッドは stderr への書き込みで待たない
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
     
     return logger
 